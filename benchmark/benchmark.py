@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite for feature extraction and prediction throughput.
+
+Deterministic synthetic SMILES corpora are generated for several molecule
+families, sizes and lengths, and every stage of the prediction is timed
+separately:
+    create_functional_groups - building the functional group table
+    extract_features         - counting the functional groups of one molecule
+                               with the feature plan of the predictor
+    predict                  - scoring one molecule from its counts
+    predict_batch            - scoring the whole corpus from its count matrix
+    properties               - the complete properties() call
+Results are reported as molecules/sec with p50/p99 latency. They can be saved
+as a JSON baseline, and a later run compared with a baseline fails when a
+stage is slower than the baseline by more than the threshold.
+
+Usage:
+    python benchmark.py --save baseline.json
+    python benchmark.py --compare baseline.json --threshold 0.2
+"""
+# -----------------------------------------------------------------------------
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code'))
+
+import time
+import json
+import random
+import argparse
+import platform
+import numpy as np
+from extract_features import create_functional_groups, ring_summary
+from properties import Predictor, properties
+# -----------------------------------------------------------------------------
+
+# Number of heavy-atom fragments of the molecules of each length class
+lengths = {'short': (6, 16), 'long': (40, 90)}
+
+# Fragments used for the heteroatom-rich molecules
+hetero_fragments = ['C', 'C', 'N', 'O', 'S', 'F', 'Cl', 'Br', 'C(=O)', 'C(=O)O', 'C(=O)N', 'C#N',
+                    '[N+](=O)[O-]', 'N=N', 'S(=O)(=O)', 'P(=O)(O)', 'C=C', 'CN(C)', 'OC', 'C(=S)']
+
+# Substituents attached to the ring carbons of the aromatic molecules
+ring_substituents = ['C', 'CC', 'O', 'OC', 'N', 'F', 'Cl', 'Br', 'C#N', 'C(=O)O', 'N(=O)=O', 'C=C']
+
+# -----------------------------------------------------------------------------
+def ring_label(i):
+    ''' Function returning the ring-closure label of ring i '''
+    return str(i) if i < 10 else '%%%d' % i
+
+def acene(n):
+# -----------------------------------------------------------------------------
+    ''' Function returning the SMILES of the linearly fused acene with n
+    rings, following the series of test_case/PAH_data.jsn. '''
+# -----------------------------------------------------------------------------
+    if n == 1:
+        return 'C1=CC=CC=C1'
+    smiles = 'C1=CC=C2' + ''.join('C=C' + ring_label(i) for i in range(3, n + 1))
+    smiles = smiles + 'C=CC=CC' + ring_label(n) + '=C'
+    return smiles + ''.join('C' + ring_label(i) + '=C' for i in range(n - 1, 1, -1)) + '1'
+
+# -----------------------------------------------------------------------------
+def substituted_acene(rng, rings):
+# -----------------------------------------------------------------------------
+    ''' Function returning an acene with one to four substituents at random
+    ring carbons; a substituent follows the ring-closure label of its atom. '''
+# -----------------------------------------------------------------------------
+    smiles = acene(rings)
+    atoms = [i for i, symbol in enumerate(smiles) if symbol == 'C']
+    positions = sorted(rng.sample(atoms, min(len(atoms), rng.randint(1, 4))), reverse=True)
+    for i in positions:
+        end = i + 1
+        while end < len(smiles) and (smiles[end].isdigit() or smiles[end] == '%'):
+            end += 1
+        smiles = smiles[:end] + '(' + rng.choice(ring_substituents) + ')' + smiles[end:]
+    return smiles
+
+# -----------------------------------------------------------------------------
+def generate_corpus(family, size, length, seed=0):
+# -----------------------------------------------------------------------------
+    ''' Function generating a deterministic corpus of distinct SMILES, so
+    that no stage is timed on cached results.
+
+    Inputs:
+            family - 'chain', 'pah' or 'hetero'
+            size - number of molecules
+            length - key of the lengths dictionary
+    Optional inputs:
+            seed - seed of the random generator
+    Output:
+            corpus - list of SMILES
+    '''
+# -----------------------------------------------------------------------------
+    rng = random.Random('%s-%d-%s-%d' % (family, size, length, seed))
+    low, high = lengths[length]
+    if family not in ('chain', 'pah', 'hetero'):
+        raise ValueError('unknown corpus family %r' % family)
+    corpus = []
+    seen = set()
+    while len(corpus) < size:
+        atoms = rng.randint(low, high)
+        if family == 'chain':
+            smiles = ''.join(rng.choice(['C', 'C', 'C', 'CC', 'C=C', 'O', 'N', 'C(C)']) for _ in range(atoms))
+        elif family == 'pah':
+            rings = rng.randint(max(1, low // 4), max(1, high // 4))
+            smiles = rng.choice(['', 'C', 'O', 'N', 'CC', 'FC', 'ClC']) + substituted_acene(rng, rings)
+        else:
+            smiles = ''.join(rng.choice(hetero_fragments) for _ in range(atoms))
+        if smiles not in seen:
+            seen.add(smiles)
+            corpus.append(smiles)
+    return corpus
+
+# -----------------------------------------------------------------------------
+def latency_stats(passes, count=None):
+# -----------------------------------------------------------------------------
+    ''' Function summarising the latencies, in seconds, of repeated passes
+    over a corpus. The throughput is that of the fastest pass, which is the
+    least affected by other load on the machine; count is the number of
+    molecules of a pass and defaults to the number of calls of a pass. '''
+# -----------------------------------------------------------------------------
+    latencies = np.concatenate([np.array(latency) for latency in passes])
+    count = len(passes[0]) if count is None else count
+    total = min(sum(latency) for latency in passes)
+    return {'molecules_per_sec': count/total if total > 0 else float('inf'),
+            'p50_us': float(np.percentile(latencies, 50))*1e6,
+            'p99_us': float(np.percentile(latencies, 99))*1e6,
+            'calls': len(latencies)}
+
+def time_each(fn, items, repeat=1, setup=None):
+    ''' Function timing fn on every item, once for every pass. The first
+    item is called once before timing. Output: list of latencies of every pass '''
+    clock = time.perf_counter
+    fn(items[0])
+    passes = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        latencies = []
+        for item in items:
+            start = clock()
+            fn(item)
+            latencies.append(clock() - start)
+        passes.append(latencies)
+    return passes
+
+# -----------------------------------------------------------------------------
+def run_corpus(corpus, predictor, repeat=3):
+# -----------------------------------------------------------------------------
+    ''' Function timing every stage on one corpus '''
+# -----------------------------------------------------------------------------
+    results = {}
+    passes = time_each(predictor.count_vector, corpus, repeat, setup=ring_summary.cache_clear)
+    results['extract_features'] = latency_stats(passes)
+
+    count_matrix = predictor.count_matrix(corpus)
+    rows = [count_matrix[i:i+1] for i in range(len(corpus))]
+    results['predict'] = latency_stats(time_each(predictor.predict_counts, rows, repeat))
+    passes = time_each(predictor.predict_counts, [count_matrix], repeat)
+    results['predict_batch'] = latency_stats(passes, count=len(corpus))
+
+    passes = time_each(properties, corpus, repeat, setup=ring_summary.cache_clear)
+    results['properties'] = latency_stats(passes)
+    return results
+
+# -----------------------------------------------------------------------------
+def run_benchmark(sizes=(200, 2000), families=('chain', 'pah', 'hetero'), length_classes=('short', 'long'),
+                  repeat=3):
+# -----------------------------------------------------------------------------
+    ''' Function running the benchmark suite.
+    Output:
+            report - dictionary with the environment and the results of every
+                     corpus, keyed by family/length/size and stage
+    '''
+# -----------------------------------------------------------------------------
+    predictor = Predictor()
+    passes = time_each(lambda _: create_functional_groups(), list(range(50)), repeat)
+    report = {'environment': {'python': platform.python_version(), 'numpy': np.__version__,
+                              'machine': platform.machine(), 'processor': platform.processor()},
+              'results': {'create_functional_groups': {'setup': latency_stats(passes)}}}
+    for family in families:
+        for length in length_classes:
+            for size in sizes:
+                corpus = generate_corpus(family, size, length)
+                name = '%s/%s/%d' % (family, length, size)
+                report['results'][name] = run_corpus(corpus, predictor, repeat)
+    return report
+
+# -----------------------------------------------------------------------------
+def compare(report, baseline, threshold):
+# -----------------------------------------------------------------------------
+    ''' Function comparing the throughput of a report with a baseline.
+    Output:
+            regressions - list of (corpus, stage, baseline, current) for the
+                          stages slower than the baseline by more than threshold
+    '''
+# -----------------------------------------------------------------------------
+    regressions = []
+    for name, stages in baseline['results'].items():
+        for stage, stats in stages.items():
+            current = report['results'].get(name, {}).get(stage)
+            if current is None:
+                continue
+            if current['molecules_per_sec'] < (1.0 - threshold)*stats['molecules_per_sec']:
+                regressions.append((name, stage, stats['molecules_per_sec'], current['molecules_per_sec']))
+    return regressions
+
+def print_report(report, stream=sys.stdout):
+    ''' Function printing the results as a table '''
+    stream.write('%-28s %-26s %14s %12s %12s\n' % ('corpus', 'stage', 'molecules/s', 'p50 us', 'p99 us'))
+    for name, stages in report['results'].items():
+        for stage, stats in stages.items():
+            stream.write('%-28s %-26s %14.1f %12.1f %12.1f\n' % (name, stage, stats['molecules_per_sec'],
+                                                                 stats['p50_us'], stats['p99_us']))
+
+# -----------------------------------------------------------------------------
+def main(argv=None):
+# -----------------------------------------------------------------------------
+    ''' Command line entry point '''
+# -----------------------------------------------------------------------------
+    parser = argparse.ArgumentParser(description='Benchmark feature extraction and prediction throughput.')
+    parser.add_argument('--sizes', default='200,2000', help='comma separated corpus sizes')
+    parser.add_argument('--families', default='chain,pah,hetero', help='comma separated corpus families')
+    parser.add_argument('--lengths', default='short,long', help='comma separated molecule length classes')
+    parser.add_argument('--repeat', type=int, default=3, help='number of passes over every corpus')
+    parser.add_argument('--save', default=None, help='write the results to this JSON file')
+    parser.add_argument('--compare', default=None, help='baseline JSON file to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed relative throughput loss against the baseline')
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(sizes=[int(size) for size in args.sizes.split(',')],
+                           families=args.families.split(','), length_classes=args.lengths.split(','),
+                           repeat=args.repeat)
+    print_report(report)
+    if args.save is not None:
+        with open(args.save, 'w') as fp:
+            json.dump(report, fp, indent=2)
+    if args.compare is not None:
+        with open(args.compare, 'r') as fp:
+            baseline = json.load(fp)
+        regressions = compare(report, baseline, args.threshold)
+        for name, stage, before, after in regressions:
+            sys.stdout.write('REGRESSION %s %s: %.1f -> %.1f molecules/s\n' % (name, stage, before, after))
+        if regressions:
+            return 1
+        sys.stdout.write('no regression beyond %.0f%%\n' % (100*args.threshold))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar on-disk corpus of SMILES with memory-mapped access.
+
+A corpus is a directory written once from a text file of SMILES:
+    smiles.bin  - the UTF-8 bytes of every SMILES, without separators
+    offsets.bin - int64 offsets of the SMILES in smiles.bin, count + 1 entries
+    lines.bin   - int64 number of the input line of every SMILES
+    homo.bin    - float64 measured HOMO of every SMILES, NaN when missing;
+                  only written when the input has a homo column
+    lumo.bin    - float64 measured LUMO, as homo.bin
+    corpus.json - number of molecules, stored energy columns and source
+The files are opened with mmap/np.memmap, so scoring reads through the page
+cache instead of loading the library into Python objects, and worker
+processes opening the same corpus share its pages. A block of molecules is
+decoded with one call and the molecules are sliced from the decoded block.
+
+Usage (from the code directory):
+    python -m corpus library.smi library.corpus
+    python -m screen library.corpus -o predictions.csv
+"""
+# -----------------------------------------------------------------------------
+import os
+import sys
+import json
+import mmap
+import argparse
+from array import array
+from contextlib import ExitStack
+import numpy as np
+from properties import Predictor
+from screen import parse_line, score_chunk
+# -----------------------------------------------------------------------------
+
+# Version of the corpus format written by build_corpus
+corpus_version = 1
+
+# -----------------------------------------------------------------------------
+def is_corpus(path):
+# -----------------------------------------------------------------------------
+    ''' Function returning True when path is a corpus directory '''
+# -----------------------------------------------------------------------------
+    return os.path.isfile(os.path.join(path, 'corpus.json'))
+
+# -----------------------------------------------------------------------------
+def build_corpus(lines, path, columns=('smiles',), delimiter=None, errors=None, source=None):
+# -----------------------------------------------------------------------------
+    ''' Function for writing a corpus from a stream of input lines. The lines
+    are parsed as in screen.py; the SMILES and the homo and lumo columns,
+    when present, are stored.
+
+    Inputs:
+            lines - iterable of raw input lines, as bytes or str
+            path - directory of the corpus, created when missing
+    Optional inputs:
+            columns - names of the columns of each line
+            delimiter - column delimiter, any whitespace by default
+            errors - text stream receiving the rejected lines
+            source - description of the input stored in corpus.json
+    Output:
+            (count, rejected) - number of stored molecules and rejected lines
+    '''
+# -----------------------------------------------------------------------------
+    os.makedirs(path, exist_ok=True)
+    meta_path = os.path.join(path, 'corpus.json')
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    energy_columns = [key for key in ['homo', 'lumo'] if key in columns]
+    count = 0
+    rejected = 0
+    position = 0
+    offsets = array('q', [0])
+    numbers = array('q')
+    energies = {key: array('d') for key in energy_columns}
+    with ExitStack() as stack:
+        smiles_fp = stack.enter_context(open(os.path.join(path, 'smiles.bin'), 'wb'))
+        offsets_fp = stack.enter_context(open(os.path.join(path, 'offsets.bin'), 'wb'))
+        lines_fp = stack.enter_context(open(os.path.join(path, 'lines.bin'), 'wb'))
+        energy_fps = {key: stack.enter_context(open(os.path.join(path, key + '.bin'), 'wb'))
+                      for key in energy_columns}
+        for number, line in enumerate(lines, 1):
+            try:
+                if isinstance(line, bytes):
+                    line = line.decode('utf-8')
+                line = line.rstrip('\r\n')
+                if not line.strip():
+                    continue
+                smiles, homo, lumo = parse_line(line, columns, delimiter)
+            except (ValueError, UnicodeDecodeError) as error:
+                if errors is not None:
+                    text = line if isinstance(line, str) else line.decode('utf-8', 'replace').rstrip('\r\n')
+                    errors.write('%d\t%s\t%s: %s\n' % (number, text, type(error).__name__, error))
+                rejected += 1
+                continue
+            encoded = smiles.encode('utf-8')
+            smiles_fp.write(encoded)
+            position += len(encoded)
+            offsets.append(position)
+            numbers.append(number)
+            for key, value in zip(['homo', 'lumo'], [homo, lumo]):
+                if key in energies:
+                    energies[key].append(np.nan if value is None else value)
+            count += 1
+            if len(numbers) >= 1 << 16:
+                np.asarray(offsets, dtype='<i8').tofile(offsets_fp)
+                np.asarray(numbers, dtype='<i8').tofile(lines_fp)
+                for key in energy_columns:
+                    np.asarray(energies[key], dtype='<f8').tofile(energy_fps[key])
+                    energies[key] = array('d')
+                offsets = array('q'); numbers = array('q')
+        np.asarray(offsets, dtype='<i8').tofile(offsets_fp)
+        np.asarray(numbers, dtype='<i8').tofile(lines_fp)
+        for key in energy_columns:
+            np.asarray(energies[key], dtype='<f8').tofile(energy_fps[key])
+# The metadata is written last, so an interrupted build is not a corpus
+    with open(meta_path + '.part', 'w') as fp:
+        json.dump({'version': corpus_version, 'count': count, 'bytes': position, 'energies': energy_columns,
+                   'source': source}, fp)
+    os.replace(meta_path + '.part', meta_path)
+    return count, rejected
+
+# -----------------------------------------------------------------------------
+class Corpus:
+# -----------------------------------------------------------------------------
+    ''' A class giving read access to a corpus directory.
+    This class has following attributes:
+        path    - directory of the corpus
+        count   - number of molecules
+        offsets - int64 array of count + 1 offsets into the SMILES buffer
+        lines   - int64 array with the input line number of every molecule
+        buffer  - memory map of the UTF-8 SMILES buffer
+        energies - dictionary of float64 arrays of the stored homo and lumo
+                   columns, NaN for missing values
+    '''
+    def __init__(self, path):
+        ''' Method to initialize the class '''
+        with open(os.path.join(path, 'corpus.json'), 'r') as fp:
+            meta = json.load(fp)
+        if meta['version'] != corpus_version:
+            raise ValueError('unsupported corpus version %r' % meta['version'])
+        self.path = path
+        self.count = meta['count']
+        self.offsets = np.memmap(os.path.join(path, 'offsets.bin'), dtype='<i8', mode='r',
+                                 shape=(self.count + 1,))
+        if self.count:
+            self.lines = np.memmap(os.path.join(path, 'lines.bin'), dtype='<i8', mode='r', shape=(self.count,))
+        else:
+            self.lines = np.zeros(0, dtype='<i8')
+        self.energies = {}
+        for key in meta.get('energies', []):
+            if self.count:
+                self.energies[key] = np.memmap(os.path.join(path, key + '.bin'), dtype='<f8', mode='r',
+                                               shape=(self.count,))
+            else:
+                self.energies[key] = np.zeros(0, dtype='<f8')
+        self._file = open(os.path.join(path, 'smiles.bin'), 'rb')
+        if meta['bytes']:
+            self.buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.buffer = b''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if not -self.count <= i < self.count:
+            raise IndexError('corpus index out of range')
+        i = i % self.count
+        return self.buffer[self.offsets[i]:self.offsets[i + 1]].decode('utf-8')
+
+    def close(self):
+        ''' Method releasing the memory maps '''
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        self._file.close()
+        self.offsets = None
+        self.lines = None
+        self.energies = {}
+
+    def strings(self, start=0, stop=None):
+        ''' Method returning the SMILES of molecules start to stop. The block
+        is decoded with one call; when it is ASCII, the molecules are sliced
+        from the decoded block at their byte offsets.
+        Output:
+            smiles_list - list of SMILES
+        '''
+        stop = self.count if stop is None else min(stop, self.count)
+        if start >= stop:
+            return []
+        offsets = (self.offsets[start:stop + 1] - self.offsets[start]).tolist()
+        block = self.buffer[self.offsets[start]:self.offsets[stop]]
+        text = block.decode('utf-8')
+        if len(text) != len(block):
+            return [block[a:b].decode('utf-8') for a, b in zip(offsets[:-1], offsets[1:])]
+        return [text[a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+
+    def records(self, start=0, stop=None):
+        ''' Method returning the molecules start to stop as the records
+        scored by screen.score_chunk: (line number, smiles, homo, lumo), with
+        None for the energies which are not stored '''
+        smiles_list = self.strings(start, stop)
+        stop = start + len(smiles_list)
+        numbers = self.lines[start:stop].tolist()
+        energies = []
+        for key in ['homo', 'lumo']:
+            if key in self.energies:
+                values = self.energies[key][start:stop].tolist()
+                energies.append([None if value != value else value for value in values])
+            else:
+                energies.append([None]*len(smiles_list))
+        return list(zip(numbers, smiles_list, energies[0], energies[1]))
+
+    def shards(self, shard_size):
+        ''' Method splitting the corpus into ranges of about shard_size bytes
+        of SMILES.
+        Output:
+            shards - list of (start, stop, first_line)
+        '''
+        targets = np.arange(shard_size, self.offsets[-1], shard_size)
+        bounds = [0] + [int(i) for i in np.searchsorted(self.offsets, targets)] + [self.count]
+        bounds = sorted(set(bounds))
+        return [(start, stop, int(self.lines[start])) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+# -----------------------------------------------------------------------------
+def score_corpus(corpus, writer, predictor=None, chunk_size=10000, start=0, stop=None, errors=None):
+# -----------------------------------------------------------------------------
+    ''' Function for scoring a range of a corpus in chunks.
+
+    Inputs:
+            corpus - Corpus to be scored
+            writer - screen.ResultWriter receiving the predictions
+    Optional inputs:
+            predictor - Predictor used for scoring, a new one by default
+            chunk_size - number of molecules scored together
+            start, stop - range of molecules, the whole corpus by default
+            errors - text stream receiving the molecules which failed
+    Output:
+            (scored, rejected) - number of scored and rejected molecules
+    '''
+# -----------------------------------------------------------------------------
+    if predictor is None:
+        predictor = Predictor()
+    stop = len(corpus) if stop is None else min(stop, len(corpus))
+    scored = 0
+    rejected = 0
+    for begin in range(start, stop, chunk_size):
+        rows, failures = score_chunk(predictor, corpus.records(begin, min(begin + chunk_size, stop)))
+        writer.write(rows)
+        if errors is not None:
+            for number, text, message in failures:
+                errors.write('%d\t%s\t%s\n' % (number, text, message))
+            errors.flush()
+        scored += len(rows)
+        rejected += len(failures)
+    return scored, rejected
+
+# -----------------------------------------------------------------------------
+def main(argv=None):
+# -----------------------------------------------------------------------------
+    ''' Command line entry point '''
+# -----------------------------------------------------------------------------
+    parser = argparse.ArgumentParser(description='Build a memory-mapped corpus from a file of SMILES.')
+    parser.add_argument('input', help='input file, one molecule per line, - for stdin')
+    parser.add_argument('corpus', help='directory of the corpus')
+    parser.add_argument('--columns', default='smiles',
+                        help='comma separated names of the input columns, e.g. smiles,homo,lumo')
+    parser.add_argument('--delimiter', default=None, help='input column delimiter (default: whitespace)')
+    parser.add_argument('--errors', default=None, help='file receiving rejected lines (default: stderr)')
+    args = parser.parse_args(argv)
+    columns = [name.strip() for name in args.columns.split(',')]
+    if 'smiles' not in columns:
+        parser.error('--columns must include smiles')
+
+    source = sys.stdin.buffer if args.input == '-' else open(args.input, 'rb')
+    errors = sys.stderr if args.errors is None else open(args.errors, 'w')
+    try:
+        count, rejected = build_corpus(source, args.corpus, columns=columns, delimiter=args.delimiter,
+                                       errors=errors,
+                                       source=None if args.input == '-' else os.path.abspath(args.input))
+    finally:
+        for stream in (source, errors):
+            if stream not in (sys.stdin.buffer, sys.stderr):
+                stream.close()
+    sys.stderr.write('stored %d molecules, rejected %d lines\n' % (count, rejected))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
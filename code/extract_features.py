@@ -2,65 +2,70 @@
 This module provide functions for fingerprinting of an organic molecules. 
 """
 # -----------------------------------------------------------------------------
-import numpy as np
 import re
+from functools import lru_cache
 from functional_group import functional_group as fg
+from substring_counter import substring_counter
+import profiling
+from profiling import timed
 # -----------------------------------------------------------------------------
 
 # -----------------------------------------------------------------------------
 # Defining functions for fingerprinting 
 # -----------------------------------------------------------------------------
-def default_function(symbol,smile):
+def default_function(symbol,smile,counts=None):
     ''' Default function for molecular fingerprinting. 
     Input:
         symbol : substring used to identify the functional group.
         smile  : SMILES representation of the molecule
+        counts : Optional dictionary of substring counts of the molecule
     Output:
         count  : Number of the functional group present in the SMILES representation
     '''     
-    count = smile.count(symbol)
+    count = counts[symbol] if counts is not None else smile.count(symbol)
     if symbol[-1] == 'C' and count > 0:
-        return count - smile.count('Cl')
+        return count - (counts['Cl'] if counts is not None else smile.count('Cl'))
     else:
         return count
 
-def number_of_rings(symbol,smile):
-    ''' Function to identify number of rings in the molecule. 
-        Input:
-        symbol : substring used to identify the functional group.
-        smile  : SMILES representation of the molecule
-    Output:
-        Number of rings in the molecule''' 
-    return int(len(re.findall('\d+', smile))/2) 
+# Ring-closure digits. A two digit closure such as %10 is matched as one token.
+ring_closure = re.compile(r'\d+')
 
-def number_of_ring_type(symbol,smile):
-    ''' Function to identify number of particular type of rings in the molecule. 
+@lru_cache(maxsize=256)
+@timed('ring_summary')
+def ring_summary(smile):
+    ''' Function analysing the rings of the molecule. The ring-closure digits 
+    are parsed once and every ring feature is summarised in a single pass. 
+    The summary is cached, so the ring features of a molecule share one analysis.
         Input:
-        symbol : substring used to identify the functional group.
         smile  : SMILES representation of the molecule
     Output:
-        A dictionary containing a count of number of particular type of rings in the molecule.
-    '''         
-    num = int(len(re.findall('\d+', smile))/2)
+        A dictionary containing the number of rings and a count of number of 
+        particular type of rings in the molecule.
+    '''
+    num = int(len(ring_closure.findall(smile))/2)
+    summary = {'rings': num}
     if num == 0:
-       return 0
+       return summary
     nb = 0; npz = 0; nep = 0; npentn = 0; npentnp = 0; 
     npyrid = 0; npyrid2 = 0; ring_length = []   
     for ir in range(1, num+1):
          st = smile.partition(str(ir))[-1].rpartition(str(ir))[0]            
          ring_length.append(len(st))
-         if st.count('C') == 5 and st.count('=') == 3:
+         nc = st.count('C'); ndb = st.count('=')
+         if nc == 5 and ndb == 3:
               nb = nb + 1
-              if st.count('C') == 4 and st.count('=') == 0:
+              no = st.count('O'); nn = st.count('N')
+              if nc == 4 and ndb == 0:
                   npz = npz + 1
-              if st.count('C') == 1 and st.count('O') == 1:
+              if nc == 1 and no == 1:
                   nep = nep + 1
-              if st.count('C') == 4 and st.count('N') == 1 and st.count('=') == 3:
+              if nc == 4 and nn == 1 and ndb == 3:
                   npyrid = npyrid + 1
-              if st.count('N') == 2:
+              if nn == 2:
                   npyrid2 = npyrid2 + 1                
 
-    return {
+    summary.update({
        'bz'           : nb,
        'pz'           : npz,
        'ep'           : nep,
@@ -68,50 +73,108 @@ def number_of_ring_type(symbol,smile):
        'pentnp'       : npentnp,
        'pyrid'        : npyrid,
        'pyrid2'       : npyrid2, 
-       'maxringlength': np.max(np.array(ring_length))        
-	 }.get(symbol,0)
+       'maxringlength': max(ring_length)
+       })
+    return summary
+
+def number_of_rings(symbol,smile):
+    ''' Function to identify number of rings in the molecule. 
+        Input:
+        symbol : substring used to identify the functional group.
+        smile  : SMILES representation of the molecule
+    Output:
+        Number of rings in the molecule''' 
+    return ring_summary(smile)['rings']
+
+def number_of_ring_type(symbol,smile):
+    ''' Function to identify number of particular type of rings in the molecule. 
+        Input:
+        symbol : substring used to identify the functional group.
+        smile  : SMILES representation of the molecule
+    Output:
+        Count of number of particular type of rings in the molecule, read from ring_summary.
+    '''         
+    if symbol == 'rings':
+       return 0
+    return ring_summary(smile).get(symbol,0)
 	   
 
-def chain_endo(symbol,smile):
+def chain_endo(symbol,smile,counts=None):
     ''' Function to identify number of chains with terminal oxygen. 
         Input:
         symbol : substring used to identify the functional group.
         smile  : SMILES representation of the molecule
+        counts : Optional dictionary of substring counts of the molecule
     Output:
         Number of chains with terminal oxygen'''     
-    return int(smile[-1]=='O') + smile.count(symbol)
+    count = counts[symbol] if counts is not None else smile.count(symbol)
+    return int(smile[-1]=='O') + count
 
-def chain_endc(symbol,smile):
+def chain_endc(symbol,smile,counts=None):
     ''' Function to identify number of chains with terminal carbon. 
         Input:
         symbol : substring used to identify the functional group.
         smile  : SMILES representation of the molecule
+        counts : Optional dictionary of substring counts of the molecule
     Output:
         Number of chains with terminal carbon'''    
-    return int(smile[-1]=='C') + smile.count(symbol)
+    count = counts[symbol] if counts is not None else smile.count(symbol)
+    return int(smile[-1]=='C') + count
 
-def chain_endn(symbol,smile):
+def chain_endn(symbol,smile,counts=None):
     ''' Function to identify number of chains with terminal nitrogen. 
         Input:
         symbol : substring used to identify the functional group.
         smile  : SMILES representation of the molecule
+        counts : Optional dictionary of substring counts of the molecule
     Output:
         Number of chains with terminal nitrogen'''        
-    return int(smile[-1]=='N') + smile.count(symbol)
+    count = counts[symbol] if counts is not None else smile.count(symbol)
+    return int(smile[-1]=='N') + count
  
-def number_of_haloformyl(symbol,smile):
+def number_of_haloformyl(symbol,smile,counts=None):
     ''' Function to identify number of haloformyl groups. 
         Input:
         symbol : substring used to identify the functional group.
         smile  : SMILES representation of the molecule
+        counts : Optional dictionary of substring counts of the molecule
     Output:
         num    : Number of Haloformyl groups in the molecule. 
     '''            
-    num = smile.count('COF') + smile.count('COCl') + smile.count('COBr') + smile.count('COI') + smile.count('COAt')
-    num = num + smile.count('C(=O)F') + smile.count('C(=O)Cl') + smile.count('C(=O)Br') + smile.count('C(=O)I') + smile.count('C(=O)At')
+    if counts is None:
+        counts = {pattern: smile.count(pattern) for pattern in haloformyl_patterns}
+    num = counts['COF'] + counts['COCl'] + counts['COBr'] + counts['COI'] + counts['COAt']
+    num = num + counts['C(=O)F'] + counts['C(=O)Cl'] + counts['C(=O)Br'] + counts['C(=O)I'] + counts['C(=O)At']
     return num
 
+# Substrings counted by number_of_haloformyl
+haloformyl_patterns = ('COF', 'COCl', 'COBr', 'COI', 'COAt',
+                       'C(=O)F', 'C(=O)Cl', 'C(=O)Br', 'C(=O)I', 'C(=O)At')
+
+# Functions which can read their substring counts from a precomputed dictionary
+counting_functions = (default_function, chain_endo, chain_endc, chain_endn, number_of_haloformyl)
+
+def substring_patterns(functional_groups, plan=None):
+    ''' Function collecting every substring counted by the functional groups. 
+    Input:
+        functional_groups: Functional group object
+        plan     : Optional keys of the functional groups which are evaluated
+    Output:
+        patterns : Tuple of substrings, in order of first use
+    '''
+    patterns = []
+    for keys in (functional_groups if plan is None else plan):
+        group = functional_groups[keys]
+        if group.Identifying_fn is number_of_haloformyl:
+            patterns.extend(haloformyl_patterns)
+        elif group.Identifying_fn in counting_functions:
+            patterns.append(group.symbol)
+            if group.Identifying_fn is default_function and group.symbol[-1] == 'C':
+                patterns.append('Cl')
+    return tuple(dict.fromkeys(patterns))
+
 # -----------------------------------------------------------------------------
+@timed('create_functional_groups')
 def create_functional_groups(): 
     ''' This function creates user-defined functional groups 
     Output:
@@ -119,110 +182,193 @@ def create_functional_groups():
     ''' 
     
     FG = {}
-    FG['carbon']        =   fg( 'C'            ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 46) #lumo
-    FG['oxygen']        =   fg( 'O'            ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 21) #lumo
-    FG['nitro']         =   fg( 'N'            ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 15) #lumo
-    FG['dbond']         =   fg( '='            ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 24) #lumo
-    FG['tbond']         =   fg( '#'            ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 4.0)
-    FG['metals']        =   fg( '['            ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 15.0)
-    FG['branch']        =   fg( '('            ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 23.0)
-    FG['rings']         =   fg( '\d+'          ,  lambda x,y:number_of_rings(x,y))
-    FG['cdb']           =   fg( 'C='           ,  lambda x,y:default_function(x,y))
-    FG['cdbcc']         =   fg( 'C=CC'         ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 6.0)
-    FG['cdbccdbcc']     =   fg( 'C=CC=CC'      ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 2.0) #lumo
-    FG['cdbccdbccdbcc'] =   fg( 'C=CC=CC=CC'   ,  lambda x,y:default_function(x,y))
-    FG['co']            =   fg( 'CO'           ,  lambda x,y:default_function(x,y))
-    FG['cn']            =   fg( 'CN'           ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 8.0)
-    FG['cno']           =   fg( 'CNO'          ,  lambda x,y:default_function(x,y))
-    FG['cc']            =   fg( 'CC'           ,  lambda x,y:default_function(x,y))
-    FG['coo']           =   fg( 'COO'          ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 5.0)
-    FG['ccc']           =   fg( 'CCC'          ,  lambda x,y:default_function(x,y))
-    FG['cccc']          =   fg( 'CCCC'         ,  lambda x,y:default_function(x,y))
-    FG['dbo']           =   fg( '=O'           ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 9) #lumo
-    FG['ndbo']          =   fg( 'N=O'          ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 3) #lumo
-    FG['sulphur']       =   fg( 'S'            ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 9)
-    FG['fluorine']      =   fg( 'F'            ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 23) #lumo
-    FG['chlorine']      =   fg( 'Cl'           ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 12) #lumo
-    FG['alkene']        =   fg( 'C=C'          ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 14) #lumo
-    FG['alkyne']        =   fg( 'C#C'          ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 4.0)
-    FG['ether']         =   fg( 'COC'          ,  lambda x,y:default_function(x,y))
-    FG['alde']          =   fg( 'CC=O'         ,  lambda x,y:default_function(x,y))
-    FG['ket']           =   fg( 'C(=O)'        ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 8) #lumo
-    FG['carbox']        =   fg( 'C(=O)O'       ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 6) #lumo
-    FG['anhy']          =   fg( 'CC(=O)OC(=O)C',  lambda x,y:default_function(x,y))
-    FG['ester']         =   fg( 'C(=O)O'       ,  lambda x,y:default_function(x,y))
-    FG['amide']         =   fg( 'C(=O)N'       ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 6) #lumo
-    FG['nitrile']       =   fg( 'C#N'          ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 4.0)
-    FG['imine']         =   fg( 'CC(=NC)C'     ,  lambda x,y:default_function(x,y))
-    FG['isocyanate']    =   fg( 'N=C=O'        ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 3.0) #lumo
-    FG['azo']           =   fg( 'N=N'          ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 3.0) #lumo
-    FG['thiol']         =   fg( 'CS'           ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 8.0) #lumo
-    FG['achalide_f']    =   fg( 'CC(=O)F'      ,  lambda x,y:default_function(x,y))
-    FG['achalide_cl']   =   fg( 'CC(=O)Cl'     ,  lambda x,y:default_function(x,y))
-    FG['achalide_br']   =   fg( 'CC(=O)Br'     ,  lambda x,y:default_function(x,y))
-    FG['achalide_i']    =   fg( 'CC(=O)I'      ,  lambda x,y:default_function(x,y))
-    FG['achalide_at']   =   fg( 'CC(=O)At'     ,  lambda x,y:default_function(x,y))
-    FG['plus']          =   fg( '+'            ,  lambda x,y:default_function(x,y))
-    FG['minus']         =   fg( '-'            ,  lambda x,y:default_function(x,y))
-    FG['br']            =   fg( 'Br'           ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 15) #lumo
-    FG['p']             =   fg( 'P'            ,  lambda x,y:default_function(x,y))
-    #FG['diff_pm']       =   fg( '_'            ,  lambda x,y:diff_fn(x,y))
-    FG['at']            =   fg( '@'            ,  lambda x,y:default_function(x,y))
-    FG['np']            =   fg( 'N+'           ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 6) #lumo
-    FG['nm']            =   fg( 'N-'           ,  lambda x,y:default_function(x,y))
-    FG['om']            =   fg( 'O-'           ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 6) #lumo
-    FG['branch_dbo']    =   fg( '(=O)'         ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 8) #lumo
-    FG['branch_dbc']    =   fg( '(=C'          ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 8) #lumo
-    FG['carb_ester']    =   fg( 'OC(=O)OC'     ,  lambda x,y:default_function(x,y))
-    FG['sec_amine']     =   fg( 'CNC'          ,  lambda x,y:default_function(x,y))
-    FG['tert_amine']    =   fg( 'CN(C'         ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 5) #lumo
-    FG['pri_ketamine']  =   fg( 'C(=N'         ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 6) #lumo
-    FG['sec_ketamine']  =   fg( 'C(=NC'        ,  lambda x,y:default_function(x,y))
-    FG['pri_aldimine']  =   fg( 'C(=N'         ,  lambda x,y:default_function(x,y))
-    FG['sec_aldimine']  =   fg( 'C(=NC'        ,  lambda x,y:default_function(x,y))
-    FG['imide']         =   fg( 'C(=O)NC(=O)'  ,  lambda x,y:default_function(x,y))
-    FG['azide']         =   fg( 'N=[N+]=[N-]'  ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 3.0)
-    FG['cyanate']       =   fg( 'OC#N'         ,  lambda x,y:default_function(x,y))
-    FG['nitrate']       =   fg( 'O[N+](=O)[O-]',  lambda x,y:default_function(x,y))
-    FG['nitrite']       =   fg( 'ON=O'         ,  lambda x,y:default_function(x,y))
-    FG['disulphide']    =   fg( 'SS'           ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 4) #lumo
-    FG['sulfinyl']      =   fg( 'SO'           ,  lambda x,y:default_function(x,y))
-    FG['sulfo']         =   fg( 'S(=O)(=O)O'   ,  lambda x,y:default_function(x,y))
-    FG['sulfonyl']      =   fg( 'S(=O)(=O)'    ,  lambda x,y:default_function(x,y))
-    FG['thiocynate']    =   fg( 'SC#N'         ,  lambda x,y:default_function(x,y))
-    FG['isothiocynate'] =   fg( 'N=C=S'        ,  lambda x,y:default_function(x,y))
-    FG['phosphono']     =   fg( 'P(=O)(O)'     ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 5.0)
-    FG['phosphate']     =   fg( 'OP(=O)(O)'    ,  lambda x,y:default_function(x,y))
-    FG['thial']         =   fg( 'C(=S'         ,  lambda x,y:default_function(x,y), min_val = 0, max_val = 2.0)
-    FG['endo']          =   fg( 'O)'           ,  lambda x,y:chain_endo(x,y), min_val = 0, max_val = 15) #lumo
-    FG['endc']          =   fg( 'C)'           ,  lambda x,y:chain_endc(x,y), min_val = 0, max_val = 20)
-    FG['endn']          =   fg( 'N)'           ,  lambda x,y:chain_endn(x,y), min_val = 0, max_val = 6) #lumo
-    FG['haloformyl']    =   fg( 'X'            ,  lambda x,y:number_of_haloformyl(x,y))
-    FG['carbonyl']      =   fg( 'C(=O)'        ,  lambda x,y:default_function(x,y))
-    FG['isonitrile']    =   fg( 'N#C'          ,  lambda x,y:default_function(x,y))
-    FG['benz']          =   fg( 'bz'           ,  lambda x,y:number_of_ring_type(x,y), min_val = 0, max_val = 7) #lumo
-    FG['penz']          =   fg( 'pz'           ,  lambda x,y:number_of_ring_type(x,y))
-    FG['epox']          =   fg( 'ep'           ,  lambda x,y:number_of_ring_type(x,y))
-    FG['pentn']         =   fg( 'pentn'        ,  lambda x,y:number_of_ring_type(x,y), min_val = 0, max_val = 4.0)
-    FG['pentnp']        =   fg( 'pentnp'       ,  lambda x,y:number_of_ring_type(x,y))
-    FG['pyrid']         =   fg( 'pyrid'        ,  lambda x,y:number_of_ring_type(x,y), min_val = 0, max_val = 4) #lumo
-    FG['pyrid2']        =   fg( 'pyrid2'       ,  lambda x,y:number_of_ring_type(x,y), min_val = 0, max_val = 4) #lumo
-    FG['maxringlength'] =   fg( 'maxringlength',  lambda x,y:number_of_ring_type(x,y), min_val = 0, max_val = 91) #lumo
+    FG['carbon']        =   fg( 'C'            ,  default_function, min_val = 0, max_val = 46) #lumo
+    FG['oxygen']        =   fg( 'O'            ,  default_function, min_val = 0, max_val = 21) #lumo
+    FG['nitro']         =   fg( 'N'            ,  default_function, min_val = 0, max_val = 15) #lumo
+    FG['dbond']         =   fg( '='            ,  default_function, min_val = 0, max_val = 24) #lumo
+    FG['tbond']         =   fg( '#'            ,  default_function, min_val = 0, max_val = 4.0)
+    FG['metals']        =   fg( '['            ,  default_function, min_val = 0, max_val = 15.0)
+    FG['branch']        =   fg( '('            ,  default_function, min_val = 0, max_val = 23.0)
+    FG['rings']         =   fg( r'\d+'         ,  number_of_rings)
+    FG['cdb']           =   fg( 'C='           ,  default_function)
+    FG['cdbcc']         =   fg( 'C=CC'         ,  default_function, min_val = 0, max_val = 6.0)
+    FG['cdbccdbcc']     =   fg( 'C=CC=CC'      ,  default_function, min_val = 0, max_val = 2.0) #lumo
+    FG['cdbccdbccdbcc'] =   fg( 'C=CC=CC=CC'   ,  default_function)
+    FG['co']            =   fg( 'CO'           ,  default_function)
+    FG['cn']            =   fg( 'CN'           ,  default_function, min_val = 0, max_val = 8.0)
+    FG['cno']           =   fg( 'CNO'          ,  default_function)
+    FG['cc']            =   fg( 'CC'           ,  default_function)
+    FG['coo']           =   fg( 'COO'          ,  default_function, min_val = 0, max_val = 5.0)
+    FG['ccc']           =   fg( 'CCC'          ,  default_function)
+    FG['cccc']          =   fg( 'CCCC'         ,  default_function)
+    FG['dbo']           =   fg( '=O'           ,  default_function, min_val = 0, max_val = 9) #lumo
+    FG['ndbo']          =   fg( 'N=O'          ,  default_function, min_val = 0, max_val = 3) #lumo
+    FG['sulphur']       =   fg( 'S'            ,  default_function, min_val = 0, max_val = 9)
+    FG['fluorine']      =   fg( 'F'            ,  default_function, min_val = 0, max_val = 23) #lumo
+    FG['chlorine']      =   fg( 'Cl'           ,  default_function, min_val = 0, max_val = 12) #lumo
+    FG['alkene']        =   fg( 'C=C'          ,  default_function, min_val = 0, max_val = 14) #lumo
+    FG['alkyne']        =   fg( 'C#C'          ,  default_function, min_val = 0, max_val = 4.0)
+    FG['ether']         =   fg( 'COC'          ,  default_function)
+    FG['alde']          =   fg( 'CC=O'         ,  default_function)
+    FG['ket']           =   fg( 'C(=O)'        ,  default_function, min_val = 0, max_val = 8) #lumo
+    FG['carbox']        =   fg( 'C(=O)O'       ,  default_function, min_val = 0, max_val = 6) #lumo
+    FG['anhy']          =   fg( 'CC(=O)OC(=O)C',  default_function)
+    FG['ester']         =   fg( 'C(=O)O'       ,  default_function)
+    FG['amide']         =   fg( 'C(=O)N'       ,  default_function, min_val = 0, max_val = 6) #lumo
+    FG['nitrile']       =   fg( 'C#N'          ,  default_function, min_val = 0, max_val = 4.0)
+    FG['imine']         =   fg( 'CC(=NC)C'     ,  default_function)
+    FG['isocyanate']    =   fg( 'N=C=O'        ,  default_function, min_val = 0, max_val = 3.0) #lumo
+    FG['azo']           =   fg( 'N=N'          ,  default_function, min_val = 0, max_val = 3.0) #lumo
+    FG['thiol']         =   fg( 'CS'           ,  default_function, min_val = 0, max_val = 8.0) #lumo
+    FG['achalide_f']    =   fg( 'CC(=O)F'      ,  default_function)
+    FG['achalide_cl']   =   fg( 'CC(=O)Cl'     ,  default_function)
+    FG['achalide_br']   =   fg( 'CC(=O)Br'     ,  default_function)
+    FG['achalide_i']    =   fg( 'CC(=O)I'      ,  default_function)
+    FG['achalide_at']   =   fg( 'CC(=O)At'     ,  default_function)
+    FG['plus']          =   fg( '+'            ,  default_function)
+    FG['minus']         =   fg( '-'            ,  default_function)
+    FG['br']            =   fg( 'Br'           ,  default_function, min_val = 0, max_val = 15) #lumo
+    FG['p']             =   fg( 'P'            ,  default_function)
+    #FG['diff_pm']       =   fg( '_'            ,  diff_fn)
+    FG['at']            =   fg( '@'            ,  default_function)
+    FG['np']            =   fg( 'N+'           ,  default_function, min_val = 0, max_val = 6) #lumo
+    FG['nm']            =   fg( 'N-'           ,  default_function)
+    FG['om']            =   fg( 'O-'           ,  default_function, min_val = 0, max_val = 6) #lumo
+    FG['branch_dbo']    =   fg( '(=O)'         ,  default_function, min_val = 0, max_val = 8) #lumo
+    FG['branch_dbc']    =   fg( '(=C'          ,  default_function, min_val = 0, max_val = 8) #lumo
+    FG['carb_ester']    =   fg( 'OC(=O)OC'     ,  default_function)
+    FG['sec_amine']     =   fg( 'CNC'          ,  default_function)
+    FG['tert_amine']    =   fg( 'CN(C'         ,  default_function, min_val = 0, max_val = 5) #lumo
+    FG['pri_ketamine']  =   fg( 'C(=N'         ,  default_function, min_val = 0, max_val = 6) #lumo
+    FG['sec_ketamine']  =   fg( 'C(=NC'        ,  default_function)
+    FG['pri_aldimine']  =   fg( 'C(=N'         ,  default_function)
+    FG['sec_aldimine']  =   fg( 'C(=NC'        ,  default_function)
+    FG['imide']         =   fg( 'C(=O)NC(=O)'  ,  default_function)
+    FG['azide']         =   fg( 'N=[N+]=[N-]'  ,  default_function, min_val = 0, max_val = 3.0)
+    FG['cyanate']       =   fg( 'OC#N'         ,  default_function)
+    FG['nitrate']       =   fg( 'O[N+](=O)[O-]',  default_function)
+    FG['nitrite']       =   fg( 'ON=O'         ,  default_function)
+    FG['disulphide']    =   fg( 'SS'           ,  default_function, min_val = 0, max_val = 4) #lumo
+    FG['sulfinyl']      =   fg( 'SO'           ,  default_function)
+    FG['sulfo']         =   fg( 'S(=O)(=O)O'   ,  default_function)
+    FG['sulfonyl']      =   fg( 'S(=O)(=O)'    ,  default_function)
+    FG['thiocynate']    =   fg( 'SC#N'         ,  default_function)
+    FG['isothiocynate'] =   fg( 'N=C=S'        ,  default_function)
+    FG['phosphono']     =   fg( 'P(=O)(O)'     ,  default_function, min_val = 0, max_val = 5.0)
+    FG['phosphate']     =   fg( 'OP(=O)(O)'    ,  default_function)
+    FG['thial']         =   fg( 'C(=S'         ,  default_function, min_val = 0, max_val = 2.0)
+    FG['endo']          =   fg( 'O)'           ,  chain_endo, min_val = 0, max_val = 15) #lumo
+    FG['endc']          =   fg( 'C)'           ,  chain_endc, min_val = 0, max_val = 20)
+    FG['endn']          =   fg( 'N)'           ,  chain_endn, min_val = 0, max_val = 6) #lumo
+    FG['haloformyl']    =   fg( 'X'            ,  number_of_haloformyl)
+    FG['carbonyl']      =   fg( 'C(=O)'        ,  default_function)
+    FG['isonitrile']    =   fg( 'N#C'          ,  default_function)
+    FG['benz']          =   fg( 'bz'           ,  number_of_ring_type, min_val = 0, max_val = 7) #lumo
+    FG['penz']          =   fg( 'pz'           ,  number_of_ring_type)
+    FG['epox']          =   fg( 'ep'           ,  number_of_ring_type)
+    FG['pentn']         =   fg( 'pentn'        ,  number_of_ring_type, min_val = 0, max_val = 4.0)
+    FG['pentnp']        =   fg( 'pentnp'       ,  number_of_ring_type)
+    FG['pyrid']         =   fg( 'pyrid'        ,  number_of_ring_type, min_val = 0, max_val = 4) #lumo
+    FG['pyrid2']        =   fg( 'pyrid2'       ,  number_of_ring_type, min_val = 0, max_val = 4) #lumo
+    FG['maxringlength'] =   fg( 'maxringlength',  number_of_ring_type, min_val = 0, max_val = 91) #lumo
 
     return FG 
 # -----------------------------------------------------------------------------
-def extract_features(molecule, functional_groups):     
-    ''' Function for molecular fingerprinting. 
+def feature_plan(functional_groups, coefficient_sets):
+    ''' Function selecting the functional groups read by a set of correlations. 
+    Inputs:
+        functional_groups: Functional group object
+        coefficient_sets : Iterable of coefficient dictionaries
+    Output:
+        plan     : Keys of the functional groups referenced by at least one 
+                   coefficient set, in the order of functional_groups
+    ''' 
+    used = set()
+    for coefs in coefficient_sets:
+        used.update(coefs.keys())
+    unknown = used - set(functional_groups) - {'bias', 'lumo', 'homo'}
+    if unknown:
+        raise ValueError('coefficients refer to unknown features: %s' % ', '.join(sorted(unknown)))
+    return [keys for keys in functional_groups if keys in used]
+
+# -----------------------------------------------------------------------------
+@timed('extract_counts')
+def extract_counts(molecule, functional_groups, counter=None, plan=None):     
+    ''' Function counting the functional groups of a molecule. All the 
+    substrings used by the functional groups are counted once, and the 
+    identifying functions read their counts from the resulting dictionary.
+    Inputs:
+        molecule : SMILES representation of molecule
+        functional_groups: Functional group object
+    Optional inputs:
+        counter  : SubstringCounter for the functional groups, built from
+                   substring_patterns(functional_groups, plan) when not provided
+        plan     : Keys of the functional groups which are evaluated, all the
+                   functional groups by default. See feature_plan.
+    Output:
+        group_counts: Dictionary with the raw count of each functional group
+    ''' 
+    if plan is None:
+        plan = functional_groups
+    if counter is None:
+        counter = substring_counter(substring_patterns(functional_groups, plan))
+    profiler = profiling.active
+    if profiler is not None:
+        return profiled_counts(profiler, molecule, functional_groups, counter, plan)
+    counts = counter.count(molecule)
+    group_counts = {} 
+
+    for keys in plan:
+        fn = functional_groups[keys].Identifying_fn
+        if fn in counting_functions:
+            group_counts[keys] = fn(functional_groups[keys].symbol,molecule,counts)
+        else:
+            group_counts[keys] = fn(functional_groups[keys].symbol,molecule)
+         
+    return group_counts     
+
+def profiled_counts(profiler, molecule, functional_groups, counter, plan):
+    ''' Function counting the functional groups as extract_counts does, 
+    recording the substring counting and every identifying function in the 
+    profiler. 
+    ''' 
+    clock = profiler.clock
+    start = clock()
+    counts = counter.count(molecule)
+    profiler.add('substring_count', clock() - start)
+    group_counts = {} 
+    timings = []
+
+    for keys in plan:
+        fn = functional_groups[keys].Identifying_fn
+        start = clock()
+        if fn in counting_functions:
+            group_counts[keys] = fn(functional_groups[keys].symbol,molecule,counts)
+        else:
+            group_counts[keys] = fn(functional_groups[keys].symbol,molecule)
+        timings.append((keys, clock() - start))
+    profiler.add_groups(timings)
+         
+    return group_counts     
+
+def extract_features(molecule, functional_groups, counter=None, plan=None):     
+    ''' Function for molecular fingerprinting. The functional groups are 
+    counted by extract_counts and every count is scaled to [-2, 2] using the 
+    min_val and max_val of its functional group.
     Inputs:
         molecule : SMILES representation of molecule
         functional_groups: Functional group object
+    Optional inputs:
+        counter  : SubstringCounter for the functional groups
+        plan     : Keys of the functional groups which are evaluated
     Output:
         features: Dictionary with value of each feature
     ''' 
+    group_counts = extract_counts(molecule, functional_groups, counter, plan)
     features = {} 
 
-    for keys in functional_groups:
-        count = functional_groups[keys].Identifying_fn(functional_groups[keys].symbol,molecule)
+    for keys in group_counts:
+        count = group_counts[keys]
         min_val = functional_groups[keys].min_val
         max_val = functional_groups[keys].max_val
                                    
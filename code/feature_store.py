@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent store of functional group counts.
+
+The counts of every functional group of a library are extracted once and
+saved, so the library can be scored again with other coefficients without
+parsing the SMILES. A store is a directory:
+    counts.npy - int32 matrix with a row per molecule and a column per
+                 functional group, opened with np.memmap
+    valid.npy  - bool array, False for the molecules which failed extraction
+    store.json - feature names, min_val/max_val of every feature, number of
+                 molecules and the hash of the corpus the store was built from
+The raw counts are stored rather than the scaled features: they are smaller,
+exact, and the predictor evaluates its lookup tables on raw counts. The
+scaled features are recovered with the min_val/max_val of the header.
+
+Usage (from the code directory):
+    python -m feature_store build library.corpus library.features
+    python -m feature_store score library.features --coefficients refit.jsn -o predictions.csv
+"""
+# -----------------------------------------------------------------------------
+import os
+import sys
+import json
+import hashlib
+import argparse
+import numpy as np
+from extract_features import create_functional_groups, extract_counts, substring_patterns
+from substring_counter import SubstringCounter
+from properties import Predictor
+from corpus import Corpus
+from screen import ResultWriter, output_columns
+from results import ResultArrayWriter, result_dtype
+# -----------------------------------------------------------------------------
+
+# Version of the store format written by build_feature_store
+store_version = 1
+
+# -----------------------------------------------------------------------------
+def corpus_hash(smiles):
+# -----------------------------------------------------------------------------
+    ''' Function returning the SHA-256 hash of a list of SMILES or of a
+    Corpus. The hash covers the int64 offsets and the UTF-8 buffer of the
+    corpus format, so a list and the corpus built from it have the same hash.
+    '''
+# -----------------------------------------------------------------------------
+    digest = hashlib.sha256()
+    if isinstance(smiles, Corpus):
+        for name in ['offsets.bin', 'smiles.bin']:
+            with open(os.path.join(smiles.path, name), 'rb') as fp:
+                for block in iter(lambda: fp.read(1 << 20), b''):
+                    digest.update(block)
+        return digest.hexdigest()
+    encoded = [text.encode('utf-8') for text in smiles]
+    offsets = np.zeros(len(encoded) + 1, dtype='<i8')
+    offsets[1:] = np.cumsum([len(text) for text in encoded])
+    digest.update(offsets.tobytes())
+    digest.update(b''.join(encoded))
+    return digest.hexdigest()
+
+# -----------------------------------------------------------------------------
+def build_feature_store(smiles, path, chunk_size=10000, errors=None):
+# -----------------------------------------------------------------------------
+    ''' Function for extracting the counts of every functional group of a
+    library and saving them as a store.
+
+    Inputs:
+            smiles - list of SMILES or a Corpus
+            path - directory of the store, created when missing
+    Optional inputs:
+            chunk_size - number of molecules extracted between writes
+            errors - text stream receiving the molecules which failed
+    Output:
+            store - the FeatureStore
+    '''
+# -----------------------------------------------------------------------------
+    functional_groups = create_functional_groups()
+    feature_names = list(functional_groups)
+    counter = SubstringCounter(substring_patterns(functional_groups))
+    n = len(smiles)
+    os.makedirs(path, exist_ok=True)
+    header_path = os.path.join(path, 'store.json')
+    if os.path.exists(header_path):
+        os.remove(header_path)
+    counts = np.lib.format.open_memmap(os.path.join(path, 'counts.npy'), mode='w+', dtype=np.int32,
+                                       shape=(n, len(feature_names)))
+    valid = np.lib.format.open_memmap(os.path.join(path, 'valid.npy'), mode='w+', dtype=bool, shape=(n,))
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        block = smiles.strings(start, stop) if isinstance(smiles, Corpus) else smiles[start:stop]
+        rows = np.zeros((stop - start, len(feature_names)), dtype=np.int32)
+        for i, text in enumerate(block):
+            try:
+                group_counts = extract_counts(text, functional_groups, counter)
+                rows[i] = [group_counts[key] for key in feature_names]
+                valid[start + i] = True
+            except Exception as error:
+                if errors is not None:
+                    number = int(smiles.lines[start + i]) if isinstance(smiles, Corpus) else start + i + 1
+                    errors.write('%d\t%s\t%s: %s\n' % (number, text, type(error).__name__, error))
+        counts[start:stop] = rows
+    counts.flush()
+    valid.flush()
+    del counts, valid
+# The header is written last, so an interrupted build is not a store
+    header = {'version': store_version, 'count': n, 'feature_names': feature_names,
+              'min_val': [functional_groups[key].min_val for key in feature_names],
+              'max_val': [functional_groups[key].max_val for key in feature_names],
+              'corpus_hash': corpus_hash(smiles),
+              'corpus': os.path.abspath(smiles.path) if isinstance(smiles, Corpus) else None}
+    with open(header_path + '.part', 'w') as fp:
+        json.dump(header, fp)
+    os.replace(header_path + '.part', header_path)
+    return FeatureStore(path)
+
+# -----------------------------------------------------------------------------
+class FeatureStore:
+# -----------------------------------------------------------------------------
+    ''' A class giving read access to a store of functional group counts.
+    This class has following attributes:
+        path          - directory of the store
+        count         - number of molecules
+        feature_names - keys of the functional groups, one per column
+        min_val       - array with the min_val of every column
+        max_val       - array with the max_val of every column
+        corpus_hash   - hash of the SMILES the store was built from
+        corpus        - path of the corpus the store was built from, or None
+        counts        - memory-mapped int32 count matrix
+        valid         - memory-mapped bool array of the extracted molecules
+    '''
+    def __init__(self, path):
+        ''' Method to initialize the class '''
+        with open(os.path.join(path, 'store.json'), 'r') as fp:
+            header = json.load(fp)
+        if header['version'] != store_version:
+            raise ValueError('unsupported feature store version %r' % header['version'])
+        self.path = path
+        self.count = header['count']
+        self.feature_names = header['feature_names']
+        self.min_val = np.array(header['min_val'], dtype=float)
+        self.max_val = np.array(header['max_val'], dtype=float)
+        self.corpus_hash = header['corpus_hash']
+        self.corpus = header['corpus']
+        self.counts = np.load(os.path.join(path, 'counts.npy'), mmap_mode='r')
+        self.valid = np.load(os.path.join(path, 'valid.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return self.count
+
+    def check(self, functional_groups):
+        ''' Method checking that the store holds the functional groups of a
+        predictor with the same scaling. A ValueError is raised otherwise. '''
+        for key in functional_groups:
+            if key not in self.feature_names:
+                raise ValueError('feature store has no column for %s' % key)
+            j = self.feature_names.index(key)
+            group = functional_groups[key]
+            if (group.min_val, group.max_val) != (self.min_val[j], self.max_val[j]):
+                raise ValueError('feature store scaling of %s differs from the functional groups' % key)
+
+    def count_matrix(self, feature_names, start=0, stop=None):
+        ''' Method returning the counts of rows start to stop as a float
+        matrix with a column per entry of feature_names, the input of
+        Predictor.predict_counts. '''
+        columns = [self.feature_names.index(key) for key in feature_names]
+        return np.asarray(self.counts[start:stop][:, columns], dtype=float)
+
+    def features(self, start=0, stop=None):
+        ''' Method returning the scaled features of rows start to stop, with
+        a column per entry of feature_names, as computed by extract_features '''
+        counts = np.asarray(self.counts[start:stop], dtype=float)
+        return -2.0 + ((4.0)/(self.max_val - self.min_val)) * (counts - self.min_val)
+
+# -----------------------------------------------------------------------------
+def score_store(store, predictor=None, start=0, stop=None, homo=None, lumo=None):
+# -----------------------------------------------------------------------------
+    ''' Function for predicting the properties of rows start to stop of a
+    store, without extracting any feature.
+
+    Inputs:
+            store - FeatureStore to be scored
+    Optional inputs:
+            predictor - Predictor used for scoring, a new one by default
+            start, stop - range of rows, the whole store by default
+            homo, lumo - measured energies of rows start to stop, NaN for
+                         the values to be predicted, e.g. Corpus.energies
+    Output:
+            output_properties - A dictionary of output property arrays, NaN
+                                for the molecules which failed extraction
+    '''
+# -----------------------------------------------------------------------------
+    if predictor is None:
+        predictor = Predictor()
+    store.check({key: predictor.functional_groups[key] for key in predictor.feature_names})
+    stop = len(store) if stop is None else min(stop, len(store))
+    output = predictor.predict_counts(store.count_matrix(predictor.feature_names, start, stop),
+                                      homo=homo, lumo=lumo)
+    invalid = ~np.asarray(store.valid[start:stop])
+    if invalid.any():
+        for key in output:
+            output[key] = np.where(invalid, np.nan, output[key])
+    return output
+
+# -----------------------------------------------------------------------------
+def main(argv=None):
+# -----------------------------------------------------------------------------
+    ''' Command line entry point '''
+# -----------------------------------------------------------------------------
+    parser = argparse.ArgumentParser(description='Build or score a store of functional group counts.')
+    commands = parser.add_subparsers(dest='command')
+    build = commands.add_parser('build', help='extract the counts of a corpus built by python -m corpus')
+    build.add_argument('corpus', help='corpus directory')
+    build.add_argument('store', help='directory of the store')
+    build.add_argument('--errors', default=None, help='file receiving the failed molecules (default: stderr)')
+    score = commands.add_parser('score', help='predict the properties of the molecules of a store')
+    score.add_argument('store', help='directory of the store')
+    score.add_argument('-o', '--output', default='-', help='output file (default: stdout)')
+    score.add_argument('--format', choices=['csv', 'jsonl', 'npy'], default='csv',
+                       help='output format; npy writes line numbers and properties without SMILES')
+    score.add_argument('--dtype', choices=['float64', 'float32'], default='float64',
+                       help='float type of the properties in npy output')
+    score.add_argument('--coefficients', default=None, help='coefficients file (default: coefficients.jsn)')
+    score.add_argument('--corpus', default=None,
+                       help='corpus providing line numbers, SMILES and measured energies (default: the corpus the store was built from)')
+    score.add_argument('--chunk-size', type=int, default=100000, help='number of molecules scored together')
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.error('a command is required (build, score)')
+
+    if args.command == 'build':
+        errors = sys.stderr if args.errors is None else open(args.errors, 'w')
+        try:
+            with Corpus(args.corpus) as corpus:
+                store = build_feature_store(corpus, args.store, errors=errors)
+        finally:
+            if errors is not sys.stderr:
+                errors.close()
+        sys.stderr.write('stored the counts of %d molecules, %d failed\n'
+                         % (len(store), len(store) - int(store.valid.sum())))
+        return 0
+
+    if args.chunk_size < 1:
+        parser.error('--chunk-size must be positive')
+    if args.format == 'npy' and args.output == '-':
+        parser.error('--format npy requires an output file')
+    store = FeatureStore(args.store)
+    corpus_path = args.corpus or store.corpus
+    if corpus_path is None:
+        parser.error('the store was not built from a corpus, use --corpus')
+    corpus = Corpus(corpus_path)
+    if corpus_hash(corpus) != store.corpus_hash:
+        parser.error('corpus %s does not match the feature store' % corpus_path)
+    predictor = Predictor(args.coefficients)
+    if args.format == 'npy':
+        output = writer = ResultArrayWriter(args.output, result_dtype(args.dtype))
+    else:
+        output = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+        writer = ResultWriter(output, args.format)
+    try:
+        for start in range(0, len(store), args.chunk_size):
+            stop = min(start + args.chunk_size, len(store))
+            energies = {key: np.asarray(corpus.energies[key][start:stop]) for key in corpus.energies}
+            prediction = score_store(store, predictor, start, stop, **energies)
+            valid = np.asarray(store.valid[start:stop])
+            if args.format == 'npy':
+                writer.append({key: prediction[key][valid] for key in prediction},
+                              ids=np.asarray(corpus.lines[start:stop])[valid])
+                continue
+            columns = [prediction[key].tolist() for key in output_columns[2:]]
+            rows = [[number, smiles] + [column[i] for column in columns]
+                    for i, (number, smiles, _, _) in enumerate(corpus.records(start, stop)) if valid[i]]
+            writer.write(rows)
+    finally:
+        corpus.close()
+        if output is not sys.stdout:
+            output.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
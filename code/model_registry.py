@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Registry evaluating several coefficient sets side by side.
+
+The coefficient files share the schema of coefficients.jsn. The functional
+groups read by any of the models are extracted once per molecule, the lookup
+tables of the models are stacked into one (models x counts) table per
+feature, and the lumo -> homo -> redox chain of every model is evaluated in
+one vectorized pass on (models x molecules) arrays.
+
+    registry = ModelRegistry({'published': 'coefficients.jsn', 'refit': 'refit.jsn'})
+    output = registry.predict_batch(smiles_list)
+    output['models']['refit']['oxidation'], output['mean']['oxidation'], output['std']['oxidation']
+"""
+# -----------------------------------------------------------------------------
+import os
+import numpy as np
+from extract_features import create_functional_groups
+from properties import (property_limits, load_coefficients, compile_coefficients, compile_lookup_tables,
+                        lookup_indices, table_range, measured_values, predict_chain, predict_unique,
+                        plan_features, extract_count_vector, extract_count_matrix, hyperbolic_tan, sigmoid)
+# -----------------------------------------------------------------------------
+
+# Properties predicted by every model
+predicted_properties = ['homo', 'lumo', 'oxidation', 'reduction']
+
+# -----------------------------------------------------------------------------
+def stack_lookup_tables(compiled_models, functional_groups, feature_names):
+# -----------------------------------------------------------------------------
+    ''' Function stacking the lookup tables of several models. A model which
+    does not read a feature has a zero table and zero coefficients for it.
+
+    Inputs:
+            compiled_models - list of coefficient sets compiled by
+                              compile_lookup_tables, one per model
+            functional_groups - dictionary of functional groups
+            feature_names - keys of the columns of the count matrix
+    Output:
+            stacked - dictionary with the (M, 1) bias, a 'lookup' list of
+                      (column, (M, size) table, c0, c1, c2, min_val, max_val)
+                      and a 'direct' list of (key, c0, c1, c2), with (M, 1)
+                      coefficient arrays
+    '''
+# -----------------------------------------------------------------------------
+    m = len(compiled_models)
+    bias = np.array([float(compiled['bias']) for compiled in compiled_models]).reshape(m, 1)
+    lookup = []
+    for j, key in enumerate(feature_names):
+        group = functional_groups[key]
+        size = table_range(group)[1]
+        table = np.zeros((m, size))
+        weights = np.zeros((3, m, 1))
+        used = False
+        for i, compiled in enumerate(compiled_models):
+            for column, model_table, c0, c1, c2, min_val, max_val in compiled['lookup']:
+                if column == j:
+                    table[i] = model_table
+                    weights[:, i, 0] = c0, c1, c2
+                    used = True
+        if used:
+            lookup.append((j, table, weights[0], weights[1], weights[2], group.min_val, group.max_val))
+    direct = []
+    for key in ['lumo', 'homo']:
+        weights = np.zeros((3, m, 1))
+        used = False
+        for i, compiled in enumerate(compiled_models):
+            for direct_key, c0, c1, c2 in compiled['direct']:
+                if direct_key == key:
+                    weights[:, i, 0] = c0, c1, c2
+                    used = True
+        if used:
+            direct.append((key, weights[0], weights[1], weights[2]))
+    return {'bias': bias, 'lookup': lookup, 'direct': direct}
+
+# -----------------------------------------------------------------------------
+def predict_stacked(columns, stacked, inputs=None):
+# -----------------------------------------------------------------------------
+    ''' Function for predicting the value of the correlation of every model.
+
+    Inputs:
+            columns - table indices built by lookup_indices
+            stacked - lookup tables stacked by stack_lookup_tables
+    Optional inputs:
+            inputs - dictionary with the scaled lumo and homo, (M, N) arrays
+    Output:
+            prop - (M, N) array of predictions, a row per model
+    '''
+# -----------------------------------------------------------------------------
+    prop = stacked['bias']
+    for j, table, c0, c1, c2, min_val, max_val in stacked['lookup']:
+        index, outside, count = columns[j]
+        term = table[:, index]
+        if outside is not None:
+            x = -2.0 + ((4.0)/(max_val - min_val)) * (count[outside] - min_val)
+            term[:, outside] = c0*x + c1*hyperbolic_tan(x) + c2*sigmoid(x)
+        prop = prop + term
+    for key, c0, c1, c2 in stacked['direct']:
+        x = inputs[key]
+        prop = prop + (c0*x + c1*hyperbolic_tan(x) + c2*sigmoid(x))
+    return prop
+
+# -----------------------------------------------------------------------------
+class ModelRegistry:
+# -----------------------------------------------------------------------------
+    ''' A class for predictions of several coefficient sets from one feature
+    extraction. The outputs hold the properties of every model, so a
+    registry is not a drop-in Predictor; the lumo -> homo -> redox chain and
+    the scoring of repeated inputs are shared with Predictor through
+    predict_chain and predict_unique, the feature plan and the counting
+    through plan_features, extract_count_vector and extract_count_matrix.
+    This class has following attributes:
+        names             - names of the models
+        coefficient_files - coefficients file of every model
+        coefficients      - list of coefficient sets, one per model
+        stacked           - lookup tables of all the models for each property
+        functional_groups - dictionary of functional groups
+        feature_names     - union of the feature plans of the models
+        pruned_features   - keys of the functional groups read by no model
+        counter           - counter of the substrings used by the feature plan
+        dedup_stats       - savings of the last predict_batch call, as in
+                            Predictor
+    '''
+    def __init__(self, coefficient_files):
+        ''' Method to initialize the class.
+        Inputs:
+            coefficient_files - dictionary of coefficients files keyed by
+                                model name, or list of files named after
+                                their base name
+        '''
+        if not isinstance(coefficient_files, dict):
+            coefficient_files = {os.path.splitext(os.path.basename(path))[0]: path for path in coefficient_files}
+        if not coefficient_files:
+            raise ValueError('no coefficients file given')
+        self.names = list(coefficient_files)
+        self.coefficient_files = [coefficient_files[name] for name in self.names]
+        self.functional_groups = create_functional_groups()
+        self.limits = {key: np.array(property_limits[key]) for key in property_limits}
+        self.dedup_stats = None
+        self.reload()
+
+    def reload(self):
+        ''' Method loading the coefficients files again '''
+        self.set_coefficients([load_coefficients(path) for path in self.coefficient_files])
+
+    def set_coefficients(self, coefficient_sets):
+        ''' Method replacing the coefficients of the models.
+        Inputs:
+            coefficient_sets - list of coefficient dictionaries, one per model
+        '''
+        keys = set(coefficient_sets[0])
+        for name, coefficients in zip(self.names, coefficient_sets):
+            if set(coefficients) != keys:
+                raise ValueError('model %s predicts %s, expected %s'
+                                 % (name, ', '.join(sorted(coefficients)), ', '.join(sorted(keys))))
+        self.coefficients = coefficient_sets
+        self.feature_names, self.pruned_features, self.counter = plan_features(
+            self.functional_groups, [coefs for coefficients in coefficient_sets for coefs in coefficients.values()])
+        self.stacked = {}
+        for key in keys:
+            compiled_models = [compile_lookup_tables(compile_coefficients(coefficients[key]),
+                                                     self.functional_groups, self.feature_names)
+                               for coefficients in coefficient_sets]
+            self.stacked[key] = stack_lookup_tables(compiled_models, self.functional_groups, self.feature_names)
+
+    def count_vector(self, smiles):
+        ''' Method for counting the functional groups of a single molecule as
+        a row of the count matrix '''
+        return extract_count_vector(smiles, self.functional_groups, self.counter, self.feature_names)
+
+    def count_matrix(self, smiles_list):
+        ''' Method for counting the functional groups of a batch, a row per
+        molecule and a column per entry of feature_names '''
+        return extract_count_matrix(smiles_list, self.functional_groups, self.counter, self.feature_names)
+
+    def predict_batch(self, smiles_list, homo=None, lumo=None, deduplicate=True):
+        ''' Method for the predictions of every model for a batch of
+        molecules; repeated inputs are scored once, as in
+        Predictor.predict_batch.
+        Output:
+            output - dictionary as returned by predict_counts
+        '''
+        if not deduplicate:
+            self.dedup_stats = None
+            return self.predict_counts(self.count_matrix(smiles_list), homo=homo, lumo=lumo)
+        output, self.dedup_stats = predict_unique(self, smiles_list, homo, lumo)
+        return output
+
+    def predict(self, smiles, homo=None, lumo=None):
+        ''' Method for the predictions of every model for a single molecule.
+        Inputs:
+            smiles - smiles representation of organic molecule
+        Optional inputs:
+            homo - Highest Occuped Molecular Orbital Energy in eV.
+            lumo - Lowest Unoccopied Molecular Orbital Energy in eV.
+        Output:
+            output - dictionary with the properties of every model under
+                     'models' and their ensemble 'mean' and 'std'
+        '''
+        output = self.predict_batch([smiles], homo=None if homo is None else [homo],
+                                    lumo=None if lumo is None else [lumo])
+        return {'models': {name: {key: float(value[0]) for key, value in properties.items()}
+                           for name, properties in output['models'].items()},
+                'mean': {key: float(value[0]) for key, value in output['mean'].items()},
+                'std': {key: float(value[0]) for key, value in output['std'].items()}}
+
+    def predict_vector(self, count_vector, homo=None, lumo=None):
+        ''' Method for the predictions of every model from a count vector '''
+        return self.predict_counts(np.array([count_vector], dtype=float), homo=None if homo is None else [homo],
+                                   lumo=None if lumo is None else [lumo])
+
+    def predict_counts(self, count_matrix, homo=None, lumo=None):
+        ''' Method for the predictions of every model from a count matrix.
+        Inputs:
+            count_matrix - array with a row per molecule
+        Optional inputs:
+            homo - Array of HOMO energies in eV, one for each molecule.
+            lumo - Array of LUMO energies in eV, one for each molecule.
+        Output:
+            output - dictionary with a dictionary of property arrays for
+                     every model under 'models', and the ensemble 'mean' and
+                     standard deviation 'std' of every property
+        '''
+        count_matrix = np.asarray(count_matrix, dtype=float).reshape(-1, len(self.feature_names))
+        shape = (len(self.names), len(count_matrix))
+        columns = lookup_indices(count_matrix, self.functional_groups, self.feature_names)
+        if lumo is not None:
+            lumo = np.broadcast_to(measured_values(lumo), shape)
+        if homo is not None:
+            homo = np.broadcast_to(measured_values(homo), shape)
+        correlation = lambda inputs, key: predict_stacked(columns, self.stacked[key], inputs)
+        stacked = predict_chain(correlation, self.limits, lumo, homo)
+        stacked = {key: np.broadcast_to(stacked[key], shape) for key in predicted_properties}
+        return {'models': {name: {key: stacked[key][i] for key in predicted_properties}
+                           for i, name in enumerate(self.names)},
+                'mean': {key: stacked[key].mean(axis=0) for key in predicted_properties},
+                'std': {key: stacked[key].std(axis=0) for key in predicted_properties}}
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-process screening of SMILES files with checkpoint and resume.
+
+The input file is split into byte-range shards aligned to line boundaries and
+the shards are scored in a process pool. Every worker creates its Predictor
+once. Finished shards are written to the checkpoint directory, so a killed run
+started again with the same checkpoint directory only scores the missing
+shards. The shard outputs are merged in input order at the end.
+"""
+# -----------------------------------------------------------------------------
+import os
+import json
+import shutil
+import tempfile
+import multiprocessing
+import numpy as np
+from properties import Predictor
+from results import ResultArrayWriter, result_dtype
+from screen import ResultWriter, screen
+from corpus import Corpus, is_corpus, score_corpus
+# -----------------------------------------------------------------------------
+
+# Predictor of the worker process, created by init_worker
+_worker_predictor = None
+
+# Corpora opened by the worker process, keyed by path
+_worker_corpora = {}
+
+# -----------------------------------------------------------------------------
+def shard_ranges(path, shard_size):
+# -----------------------------------------------------------------------------
+    ''' Function for splitting a file into byte ranges aligned to lines.
+
+    Inputs:
+            path - path of the input file
+            shard_size - approximate number of bytes in a shard
+    Output:
+            shards - list of (start, end, first_line) with the byte range
+                     and the number of the first line of every shard
+    '''
+# -----------------------------------------------------------------------------
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, 'rb') as fp:
+        while bounds[-1] < size:
+            fp.seek(min(bounds[-1] + shard_size, size))
+            if fp.tell() < size:
+                fp.seek(fp.tell() - 1)
+                fp.readline()
+            bounds.append(fp.tell())
+        shards = []
+        first_line = 1
+        fp.seek(0)
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            shards.append((start, end, first_line))
+            remaining = end - start
+            while remaining > 0:
+                block = fp.read(min(remaining, 1 << 20))
+                first_line += block.count(b'\n')
+                remaining -= len(block)
+    return shards
+
+# -----------------------------------------------------------------------------
+def read_range(path, start, end):
+# -----------------------------------------------------------------------------
+    ''' Generator over the lines of a byte range of a file '''
+# -----------------------------------------------------------------------------
+    with open(path, 'rb') as fp:
+        fp.seek(start)
+        position = start
+        while position < end:
+            line = fp.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line
+
+# -----------------------------------------------------------------------------
+def init_worker(coefficients_file):
+# -----------------------------------------------------------------------------
+    ''' Function run once in every worker process to load the predictor '''
+# -----------------------------------------------------------------------------
+    global _worker_predictor
+    _worker_predictor = Predictor(coefficients_file)
+
+# -----------------------------------------------------------------------------
+def score_shard(task):
+# -----------------------------------------------------------------------------
+    ''' Function scoring one shard in a worker process. A shard is a byte
+    range of a text file, or a range of molecules of a corpus. The output is written
+    to a temporary file and renamed when complete, so a shard file in the
+    checkpoint directory is always a finished shard.
+
+    Inputs:
+            task - (index, path, start, end, first_line, checkpoint, options)
+    Output:
+            (index, scored, rejected)
+    '''
+# -----------------------------------------------------------------------------
+    index, path, start, end, first_line, checkpoint, options = task
+    output_path, errors_path = shard_paths(checkpoint, index, options['format'])
+    if options['format'] == 'npy':
+        output = writer = ResultArrayWriter(output_path + '.part', result_dtype(options['dtype']))
+    else:
+        output = open(output_path + '.part', 'w', newline='')
+        writer = ResultWriter(output, options['format'], header=False)
+    with output, open(errors_path, 'w') as errors:
+        if is_corpus(path):
+            if path not in _worker_corpora:
+                _worker_corpora[path] = Corpus(path)
+            scored, rejected = score_corpus(_worker_corpora[path], writer, _worker_predictor,
+                                            chunk_size=options['chunk_size'], start=start, stop=end,
+                                            errors=errors)
+        else:
+            scored, rejected = screen(read_range(path, start, end), writer, _worker_predictor,
+                                      chunk_size=options['chunk_size'], columns=options['columns'],
+                                      delimiter=options['delimiter'], errors=errors, first_line=first_line)
+    os.replace(output_path + '.part', output_path)
+    return index, scored, rejected
+
+# -----------------------------------------------------------------------------
+def shard_paths(checkpoint, index, format):
+# -----------------------------------------------------------------------------
+    ''' Function returning the output and error file of a shard '''
+# -----------------------------------------------------------------------------
+    name = os.path.join(checkpoint, 'shard-%06d' % index)
+    return name + '.' + format, name + '.err'
+
+# -----------------------------------------------------------------------------
+def load_manifest(checkpoint, path, options, shard_size):
+# -----------------------------------------------------------------------------
+    ''' Function returning the shard plan of a run. The plan is stored in the
+    checkpoint directory and reused on resume. A checkpoint directory holding
+    the plan of a different input or different options is rejected.
+    '''
+# -----------------------------------------------------------------------------
+    stat = os.stat(os.path.join(path, 'corpus.json') if is_corpus(path) else path)
+    run = {'input': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+           'shard_size': shard_size, 'options': options}
+    manifest_path = os.path.join(checkpoint, 'manifest.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as fp:
+            manifest = json.load(fp)
+        if manifest['run'] != json.loads(json.dumps(run)):
+            raise ValueError('checkpoint directory %s belongs to a different run' % checkpoint)
+        return [tuple(shard) for shard in manifest['shards']]
+    if is_corpus(path):
+        with Corpus(path) as corpus:
+            shards = corpus.shards(shard_size)
+    else:
+        shards = shard_ranges(path, shard_size)
+    with open(manifest_path + '.part', 'w') as fp:
+        json.dump({'run': run, 'shards': shards}, fp)
+    os.replace(manifest_path + '.part', manifest_path)
+    return shards
+
+# -----------------------------------------------------------------------------
+def screen_parallel(path, output, workers=None, checkpoint=None, shard_size=64 << 20,
+                    format='csv', chunk_size=10000, columns=('smiles',), delimiter=None,
+                    errors=None, coefficients_file=None, dtype='float64'):
+# -----------------------------------------------------------------------------
+    ''' Function for screening a SMILES file with a pool of processes.
+
+    Inputs:
+            path - path of the input file or of a corpus directory
+            output - text stream receiving the predictions in input order,
+                     or a results.ResultArrayWriter for the npy format
+    Optional inputs:
+            workers - number of worker processes, os.cpu_count() by default
+            checkpoint - directory holding finished shards; a temporary
+                         directory is used when not given, and the run can
+                         only be resumed when a directory is given
+            shard_size - approximate number of bytes in a shard
+            format, chunk_size, columns, delimiter, dtype - as in screen.py
+            errors - text stream receiving the rejected lines
+            coefficients_file - coefficients file used by the workers
+    Output:
+            (scored, rejected) - number of scored and rejected lines
+    '''
+# -----------------------------------------------------------------------------
+    options = {'format': format, 'chunk_size': chunk_size, 'columns': list(columns),
+               'delimiter': delimiter, 'coefficients_file': coefficients_file, 'dtype': dtype}
+    temporary = checkpoint is None
+    if temporary:
+        checkpoint = tempfile.mkdtemp(prefix='screen-')
+    os.makedirs(checkpoint, exist_ok=True)
+    try:
+        shards = load_manifest(checkpoint, path, options, shard_size)
+        tasks = []
+        for index, (start, end, first_line) in enumerate(shards):
+            if not os.path.exists(shard_paths(checkpoint, index, format)[0]):
+                tasks.append((index, path, start, end, first_line, checkpoint, options))
+        if tasks:
+            with multiprocessing.Pool(workers, initializer=init_worker,
+                                      initargs=(coefficients_file,)) as pool:
+                for _ in pool.imap_unordered(score_shard, tasks):
+                    pass
+# Merging the shards in input order
+        if format != 'npy':
+            ResultWriter(output, format)
+        scored = 0
+        rejected = 0
+        for index in range(len(shards)):
+            output_path, errors_path = shard_paths(checkpoint, index, format)
+            if format == 'npy':
+                records = np.load(output_path, mmap_mode='r')
+                output.append_records(records)
+                scored += len(records)
+                del records
+            else:
+                with open(output_path, 'r', newline='') as fp:
+                    for line in fp:
+                        output.write(line)
+                        scored += 1
+            with open(errors_path, 'r') as fp:
+                for line in fp:
+                    if errors is not None:
+                        errors.write(line)
+                    rejected += 1
+        if format != 'npy':
+            output.flush()
+    except BaseException:
+        if temporary:
+            shutil.rmtree(checkpoint, ignore_errors=True)
+        raise
+    remove_checkpoint(checkpoint, len(shards), format)
+    return scored, rejected
+
+# -----------------------------------------------------------------------------
+def remove_checkpoint(checkpoint, count, format):
+# -----------------------------------------------------------------------------
+    ''' Function removing the files of a finished run from the checkpoint
+    directory. The directory itself is only removed when it is left empty. '''
+# -----------------------------------------------------------------------------
+    for index in range(count):
+        for name in shard_paths(checkpoint, index, format):
+            os.remove(name)
+    os.remove(os.path.join(checkpoint, 'manifest.json'))
+    if not os.listdir(checkpoint):
+        os.rmdir(checkpoint)
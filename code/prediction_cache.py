@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides a cache of predictions keyed by SMILES.
+
+Predictions are kept in an in-memory LRU and, optionally, in a SQLite file
+that survives restarts. The key is made of the SMILES, a fingerprint of the
+coefficients file and the HOMO/LUMO overrides, and the cache notices when the
+coefficients file changes on disk. The rows of the SQLite file computed with
+other coefficients are deleted when the cache is opened and when the
+coefficients change, so they do not accumulate across refits.
+"""
+# -----------------------------------------------------------------------------
+import os
+import json
+import sqlite3
+import hashlib
+from collections import OrderedDict
+import numpy as np
+from properties import Predictor, measured_values
+# -----------------------------------------------------------------------------
+
+# Properties stored for every prediction
+cached_properties = ['homo', 'lumo', 'oxidation', 'reduction']
+
+# -----------------------------------------------------------------------------
+def coefficients_fingerprint(filepath):
+# -----------------------------------------------------------------------------
+    ''' Function returning the SHA-256 digest of a coefficients file '''
+# -----------------------------------------------------------------------------
+    with open(filepath, 'rb') as fp:
+        return hashlib.sha256(fp.read()).hexdigest()
+
+# -----------------------------------------------------------------------------
+class LRUCache:
+# -----------------------------------------------------------------------------
+    ''' A least recently used cache with hit, miss and eviction counters.
+    This class has following attributes:
+        maxsize   - maximum number of entries, None for no limit
+        hits      - number of successful lookups
+        misses    - number of failed lookups
+        evictions - number of entries dropped to respect maxsize
+    '''
+    def __init__(self, maxsize=100000):
+        ''' Method to initialize the class '''
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, count_miss=True):
+        ''' Method returning the value stored for key, or None. With
+        count_miss=False a failed lookup is left for the caller to count. '''
+        value = self._data.get(key)
+        if value is None:
+            if count_miss:
+                self.misses += 1
+        else:
+            self.hits += 1
+            self._data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        ''' Method storing a value, evicting the least recently used entries '''
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if self.maxsize is not None:
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        ''' Method removing every entry; the counters are kept '''
+        self._data.clear()
+
+# -----------------------------------------------------------------------------
+class PredictionCache:
+# -----------------------------------------------------------------------------
+    ''' A class caching feature extraction and prediction.
+    Predictions are keyed by SMILES, coefficients fingerprint and the HOMO/LUMO
+    overrides; count vectors are keyed by SMILES. When the coefficients file
+    changes on disk, the predictor is reloaded, which also recomputes its
+    feature plan, and the predictions made with the old coefficients are no
+    longer returned.
+    This class has following attributes:
+        predictor   - Predictor used for cache misses
+        fingerprint - fingerprint of the coefficients in use
+        predictions - LRU of predictions
+        features    - LRU of functional group count vectors
+        path        - optional SQLite file with persisted predictions
+    '''
+    def __init__(self, predictor=None, maxsize=100000, path=None, commit_every=1000):
+        ''' Method to initialize the class '''
+        if predictor is None:
+            predictor = Predictor()
+        self.predictor = predictor
+        self.predictions = LRUCache(maxsize)
+        self.features = LRUCache(maxsize)
+        self.path = path
+        self.commit_every = commit_every
+        self.disk_hits = 0
+        self.invalidations = 0
+        self._pending = 0
+        self._stamp = self._file_stamp()
+        self.fingerprint = coefficients_fingerprint(predictor.coefficients_file)
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path)
+            self._db.execute('CREATE TABLE IF NOT EXISTS predictions (key TEXT PRIMARY KEY, fingerprint TEXT, '
+                             'homo REAL, lumo REAL, oxidation REAL, reduction REAL)')
+            columns = [row[1] for row in self._db.execute('PRAGMA table_info(predictions)')]
+            if 'fingerprint' not in columns:
+# Files written before the fingerprint column: the fingerprint is the first entry of the key
+                self._db.execute('ALTER TABLE predictions ADD COLUMN fingerprint TEXT')
+                keys = [row[0] for row in self._db.execute('SELECT key FROM predictions')]
+                self._db.executemany('UPDATE predictions SET fingerprint = ? WHERE key = ?',
+                                     [(json.loads(key)[0], key) for key in keys])
+            self._delete_stale()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _file_stamp(self):
+        stat = os.stat(self.predictor.coefficients_file)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def check_coefficients(self):
+        ''' Method reloading the predictor when the coefficients file changed.
+        Output:
+            True when the cached predictions were invalidated
+        '''
+        stamp = self._file_stamp()
+        if stamp == self._stamp:
+            return False
+        self._stamp = stamp
+        fingerprint = coefficients_fingerprint(self.predictor.coefficients_file)
+        if fingerprint == self.fingerprint:
+            return False
+        self.predictor.reload()
+        self.fingerprint = fingerprint
+        self.predictions.clear()
+        self.features.clear()
+        self.invalidations += 1
+        self._delete_stale()
+        return True
+
+    def _delete_stale(self):
+        ''' Method deleting the rows of the SQLite file computed with other
+        coefficients than the current ones '''
+        if self._db is not None:
+            self._db.execute('DELETE FROM predictions WHERE fingerprint IS NOT ?', (self.fingerprint,))
+            self.flush()
+
+    def key(self, smiles, homo=None, lumo=None):
+        ''' Method returning the cache key of a prediction '''
+        return json.dumps([self.fingerprint, smiles, homo, lumo])
+
+    def _lookup(self, key):
+        value = self.predictions.get(key, count_miss=False)
+        if value is None and self._db is not None:
+            row = self._db.execute('SELECT homo, lumo, oxidation, reduction FROM predictions '
+                                   'WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                value = dict(zip(cached_properties, row))
+                self.predictions.put(key, value)
+                self.disk_hits += 1
+        if value is None:
+            self.predictions.misses += 1
+        return value
+
+    def _store(self, key, value):
+        self.predictions.put(key, value)
+        if self._db is not None:
+            self._db.execute('INSERT OR REPLACE INTO predictions (key, fingerprint, homo, lumo, oxidation, reduction) '
+                             'VALUES (?, ?, ?, ?, ?, ?)',
+                             (key, self.fingerprint) + tuple(value[name] for name in cached_properties))
+            self._pending += 1
+            if self._pending >= self.commit_every:
+                self.flush()
+
+    def count_vector(self, smiles):
+        ''' Method returning the cached count vector of a molecule '''
+        vector = self.features.get(smiles)
+        if vector is None:
+            vector = self.predictor.count_vector(smiles)
+            self.features.put(smiles, vector)
+        return vector
+
+    def predict(self, smiles, homo=None, lumo=None):
+        ''' Method for cached orbital energies and redox potentials prediction.
+        Inputs:
+            smiles - smiles representation of organic molecule
+        Optional inputs:
+            homo - Highest Occuped Molecular Orbital Energy in eV.
+            lumo - Lowest Unoccopied Molecular Orbital Energy in eV.
+        Output:
+            output_properties - A dictionary of output properties
+        '''
+        output = self.predict_batch([smiles], homo=None if homo is None else [homo],
+                                    lumo=None if lumo is None else [lumo])
+        return {name: float(output[name][0]) for name in cached_properties}
+
+    def predict_batch(self, smiles_list, homo=None, lumo=None):
+        ''' Method for cached prediction of a batch of molecules. The misses
+        are scored together with one vectorized call.
+        Inputs:
+            smiles_list - list of smiles representations of organic molecules
+        Optional inputs:
+            homo - Array of HOMO energies in eV, one for each molecule.
+            lumo - Array of LUMO energies in eV, one for each molecule.
+        Output:
+            output_properties - A dictionary of output property arrays
+        '''
+        self.check_coefficients()
+        n = len(smiles_list)
+        homo_list = [None]*n if homo is None else [None if value != value else float(value)
+                                                   for value in measured_values(homo).tolist()]
+        lumo_list = [None]*n if lumo is None else [None if value != value else float(value)
+                                                   for value in measured_values(lumo).tolist()]
+        output = {name: np.empty(n) for name in cached_properties}
+        keys = [self.key(smiles, h, l) for smiles, h, l in zip(smiles_list, homo_list, lumo_list)]
+        missing = []
+        for i, key in enumerate(keys):
+            value = self._lookup(key)
+            if value is None:
+                missing.append(i)
+            else:
+                for name in cached_properties:
+                    output[name][i] = value[name]
+        if missing:
+            matrix = np.array([self.count_vector(smiles_list[i]) for i in missing], dtype=float)
+            matrix = matrix.reshape(len(missing), len(self.predictor.feature_names))
+            prediction = self.predictor.predict_counts(
+                matrix,
+                homo=None if homo is None else [homo_list[i] for i in missing],
+                lumo=None if lumo is None else [lumo_list[i] for i in missing])
+            for j, i in enumerate(missing):
+                value = {name: float(prediction[name][j]) for name in cached_properties}
+                for name in cached_properties:
+                    output[name][i] = value[name]
+                self._store(keys[i], value)
+        return output
+
+    def stats(self):
+        ''' Method returning the cache counters. A prediction lookup counts
+        as one of 'hits' (memory), 'disk_hits' (SQLite file) or 'misses'
+        (predicted), so the three add up to the number of lookups. '''
+        return {'hits': self.predictions.hits, 'misses': self.predictions.misses,
+                'evictions': self.predictions.evictions, 'size': len(self.predictions),
+                'disk_hits': self.disk_hits, 'invalidations': self.invalidations,
+                'feature_hits': self.features.hits, 'feature_misses': self.features.misses,
+                'feature_evictions': self.features.evictions}
+
+    def flush(self):
+        ''' Method committing pending writes to the SQLite file '''
+        if self._db is not None:
+            self._db.commit()
+        self._pending = 0
+
+    def close(self):
+        ''' Method committing pending writes and closing the SQLite file '''
+        if self._db is not None:
+            self.flush()
+            self._db.close()
+            self._db = None
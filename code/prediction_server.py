@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+"""
+Local prediction server with request micro-batching.
+
+The server loads the coefficients once and listens on a Unix socket or on a
+TCP port. The protocol is line-delimited JSON: each request line is answered
+by one response line carrying the same id.
+
+    {"id": 1, "smiles": "C1=CC=CC=C1"}
+    {"id": 1, "homo": ..., "lumo": ..., "oxidation": ..., "reduction": ...}
+    {"id": 2, "smiles": "CCO", "homo": -7.1, "lumo": null}
+    {"id": 3, "op": "status"}
+    {"id": 3, "status": {"requests": ..., "latency_p50_ms": ..., ...}}
+
+Requests of all the connections are gathered into micro-batches of at most
+max_batch_size molecules, waiting at most max_wait_ms for a batch to fill,
+and every batch is scored with one vectorized pass. At most max_pending
+requests are queued; when the queue is full the server stops reading from
+the connections until it drains, and every connection has at most
+max_inflight unanswered requests.
+
+Usage (from the code directory):
+    python -m prediction_server --unix /tmp/qsroar.sock
+    python -m prediction_server --host 127.0.0.1 --port 8765 --max-batch-size 512 --max-wait-ms 2
+"""
+# -----------------------------------------------------------------------------
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from properties import Predictor
+from screen import score_chunk, output_columns
+# -----------------------------------------------------------------------------
+
+# Longest accepted request line in bytes
+max_line_length = 1 << 20
+
+# -----------------------------------------------------------------------------
+def check_request(request):
+# -----------------------------------------------------------------------------
+    ''' Function for checking a decoded request.
+
+    Inputs:
+            request - decoded JSON of the request line
+    Output:
+            op - 'predict' or 'status'; a ValueError is raised for an invalid
+                 request
+    '''
+# -----------------------------------------------------------------------------
+    if not isinstance(request, dict):
+        raise ValueError('request must be a JSON object')
+    op = request.get('op', 'predict')
+    if op not in ('predict', 'status'):
+        raise ValueError('unknown op %r' % op)
+    if op == 'status':
+        return op
+    smiles = request.get('smiles')
+    if not isinstance(smiles, str) or not smiles.strip():
+        raise ValueError('missing SMILES')
+    for key in ['homo', 'lumo']:
+        value = request.get(key)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+            raise ValueError('%s must be a number' % key)
+    return op
+
+# -----------------------------------------------------------------------------
+class PredictionServer:
+# -----------------------------------------------------------------------------
+    ''' An asyncio server scoring requests in micro-batches.
+    This class has following attributes:
+        predictor      - Predictor used for scoring
+        max_batch_size - maximum number of molecules in a batch
+        max_wait_ms    - longest time a batch waits for more requests
+        max_pending    - maximum number of queued requests
+        max_inflight   - maximum number of unanswered requests per connection
+    '''
+    def __init__(self, predictor=None, max_batch_size=256, max_wait_ms=2.0, max_pending=10000,
+                 max_inflight=1000):
+        ''' Method to initialize the class '''
+        if predictor is None:
+            predictor = Predictor()
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_pending = max_pending
+        self.max_inflight = max_inflight
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.connections = 0
+        self.latencies = deque(maxlen=10000)
+        self._started = time.time()
+        self._queue = None
+        self._server = None
+        self._batcher = None
+        self._executor = ThreadPoolExecutor(1)
+
+    async def start(self, path=None, host='127.0.0.1', port=8765):
+        ''' Method starting the server on the Unix socket path, or on the TCP
+        host and port when no path is given. '''
+        self._queue = asyncio.Queue(self.max_pending)
+        self._batcher = asyncio.get_event_loop().create_task(self._batch_loop())
+        if path is not None:
+            self._server = await asyncio.start_unix_server(self._handle, path, limit=max_line_length)
+        else:
+            self._server = await asyncio.start_server(self._handle, host, port, limit=max_line_length)
+        return self._server
+
+    async def serve_forever(self):
+        ''' Method serving until the task is cancelled; the server is then
+        closed '''
+        try:
+            await asyncio.get_event_loop().create_future()
+        finally:
+            await self.close()
+
+    async def close(self):
+        ''' Method stopping the server '''
+        self._server.close()
+        await self._server.wait_closed()
+        self._batcher.cancel()
+        self._executor.shutdown(wait=False)
+
+    def status(self):
+        ''' Method returning the latency and throughput counters '''
+        uptime = time.time() - self._started
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        return {'uptime': uptime, 'requests': self.requests, 'errors': self.errors,
+                'batches': self.batches, 'mean_batch_size': self.requests/self.batches if self.batches else 0.0,
+                'requests_per_sec': self.requests/uptime if uptime > 0 else 0.0,
+                'latency_p50_ms': float(np.percentile(latencies, 50))*1e3,
+                'latency_p99_ms': float(np.percentile(latencies, 99))*1e3,
+                'queue_depth': self._queue.qsize() if self._queue is not None else 0,
+                'connections': self.connections,
+                'max_batch_size': self.max_batch_size, 'max_wait_ms': self.max_wait_ms}
+
+    async def _handle(self, reader, writer):
+        loop = asyncio.get_event_loop()
+        inflight = asyncio.Semaphore(self.max_inflight)
+        pending = set()
+        self.connections += 1
+
+        def respond(response):
+            if not writer.transport.is_closing():
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+
+        def answered(future, request_id):
+            pending.discard(future)
+            inflight.release()
+            if not future.cancelled():
+                response = future.result()
+                response['id'] = request_id
+                respond(response)
+
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    respond({'id': None, 'error': 'request longer than %d bytes' % max_line_length})
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                request = None
+                try:
+                    request = json.loads(line)
+                    op = check_request(request)
+                except ValueError as error:
+                    self.errors += 1
+                    request_id = request.get('id') if isinstance(request, dict) else None
+                    respond({'id': request_id, 'error': '%s: %s' % (type(error).__name__, error)})
+                    continue
+                if op == 'status':
+                    respond({'id': request.get('id'), 'status': self.status()})
+                    continue
+                await inflight.acquire()
+                future = loop.create_future()
+                pending.add(future)
+                future.add_done_callback(lambda future, request_id=request.get('id'): answered(future, request_id))
+                await self._queue.put((request['smiles'].strip(), request.get('homo'), request.get('lumo'),
+                                       future, loop.time()))
+                await writer.drain()
+            if pending:
+                await asyncio.wait(list(pending))
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def _batch_loop(self):
+        loop = asyncio.get_event_loop()
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.max_wait_ms/1e3
+            while len(batch) < self.max_batch_size:
+                if not queue.empty():
+                    batch.append(queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            responses = await loop.run_in_executor(self._executor, self._score, batch)
+            now = loop.time()
+            self.batches += 1
+            for (smiles, homo, lumo, future, received), response in zip(batch, responses):
+                self.requests += 1
+                if 'error' in response:
+                    self.errors += 1
+                self.latencies.append(now - received)
+                if not future.done():
+                    future.set_result(response)
+
+    def _score(self, batch):
+        records = [(i, smiles, homo, lumo) for i, (smiles, homo, lumo, _, _) in enumerate(batch)]
+        try:
+            rows, errors = score_chunk(self.predictor, records)
+        except Exception as error:
+            return [{'error': '%s: %s' % (type(error).__name__, error)} for _ in batch]
+        responses = [None]*len(batch)
+        for row in rows:
+            responses[row[0]] = dict(zip(output_columns[2:], row[2:]))
+        for number, smiles, message in errors:
+            responses[number] = {'error': message}
+        return responses
+
+# -----------------------------------------------------------------------------
+class PredictionClient:
+# -----------------------------------------------------------------------------
+    ''' A blocking client of the prediction server.
+    This class has following attributes:
+        window - number of requests sent before reading their responses
+    '''
+    def __init__(self, path=None, host='127.0.0.1', port=8765, timeout=None, window=1000):
+        ''' Method to initialize the class. The client connects to the Unix
+        socket path, or to the TCP host and port when no path is given. '''
+        if path is not None:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.settimeout(timeout)
+            self._socket.connect(path)
+        else:
+            self._socket = socket.create_connection((host, port), timeout)
+        self._file = self._socket.makefile('rwb')
+        self.window = window
+        self._next_id = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        ''' Method closing the connection '''
+        self._file.close()
+        self._socket.close()
+
+    def _exchange(self, requests):
+        ids = []
+        for request in requests:
+            self._next_id += 1
+            request['id'] = self._next_id
+            ids.append(self._next_id)
+            self._file.write(json.dumps(request).encode('utf-8') + b'\n')
+        self._file.flush()
+        responses = {}
+        while len(responses) < len(ids):
+            line = self._file.readline()
+            if not line:
+                raise ConnectionError('connection closed by the server')
+            response = json.loads(line)
+            if response.get('id') is None:
+                raise ValueError(response.get('error', 'invalid response'))
+            responses[response.pop('id')] = response
+        return [responses[i] for i in ids]
+
+    def predict(self, smiles, homo=None, lumo=None):
+        ''' Method for orbital energies and redox potentials prediction.
+        Inputs:
+            smiles - smiles representation of organic molecule
+        Optional inputs:
+            homo - Highest Occuped Molecular Orbital Energy in eV.
+            lumo - Lowest Unoccopied Molecular Orbital Energy in eV.
+        Output:
+            output_properties - A dictionary of output properties
+        '''
+        response = self._exchange([{'smiles': smiles, 'homo': homo, 'lumo': lumo}])[0]
+        if 'error' in response:
+            raise ValueError(response['error'])
+        return response
+
+    def predict_many(self, smiles_list, homo=None, lumo=None):
+        ''' Method for prediction of many molecules. The requests are
+        pipelined, window requests at a time.
+        Inputs:
+            smiles_list - list of smiles representations of organic molecules
+        Optional inputs:
+            homo - list of HOMO energies in eV or None, one for each molecule.
+            lumo - list of LUMO energies in eV or None, one for each molecule.
+        Output:
+            responses - list of dictionaries of output properties, in input
+                        order; molecules which failed hold an error message
+        '''
+        n = len(smiles_list)
+        homo = [None]*n if homo is None else homo
+        lumo = [None]*n if lumo is None else lumo
+        responses = []
+        for start in range(0, n, self.window):
+            stop = min(start + self.window, n)
+            responses += self._exchange([{'smiles': smiles_list[i], 'homo': homo[i], 'lumo': lumo[i]}
+                                         for i in range(start, stop)])
+        return responses
+
+    def status(self):
+        ''' Method returning the latency and throughput counters of the server '''
+        return self._exchange([{'op': 'status'}])[0]['status']
+
+# -----------------------------------------------------------------------------
+def main(argv=None):
+# -----------------------------------------------------------------------------
+    ''' Command line entry point '''
+# -----------------------------------------------------------------------------
+    parser = argparse.ArgumentParser(description='Serve orbital energies and redox potentials predictions.')
+    parser.add_argument('--unix', default=None, help='path of the Unix socket to listen on')
+    parser.add_argument('--host', default='127.0.0.1', help='TCP host, when no Unix socket is given')
+    parser.add_argument('--port', type=int, default=8765, help='TCP port, when no Unix socket is given')
+    parser.add_argument('--max-batch-size', type=int, default=256, help='maximum number of molecules in a batch')
+    parser.add_argument('--max-wait-ms', type=float, default=2.0, help='longest time a batch waits for requests')
+    parser.add_argument('--max-pending', type=int, default=10000, help='maximum number of queued requests')
+    parser.add_argument('--max-inflight', type=int, default=1000,
+                        help='maximum number of unanswered requests per connection')
+    parser.add_argument('--coefficients', default=None, help='coefficients file (default: coefficients.jsn)')
+    args = parser.parse_args(argv)
+    for name in ['max_batch_size', 'max_pending', 'max_inflight']:
+        if getattr(args, name) < 1:
+            parser.error('--%s must be positive' % name.replace('_', '-'))
+    if args.max_wait_ms < 0:
+        parser.error('--max-wait-ms must not be negative')
+
+    server = PredictionServer(Predictor(args.coefficients), max_batch_size=args.max_batch_size,
+                              max_wait_ms=args.max_wait_ms, max_pending=args.max_pending,
+                              max_inflight=args.max_inflight)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(server.start(path=args.unix, host=args.host, port=args.port))
+    sys.stderr.write('listening on %s\n' % (args.unix or '%s:%d' % (args.host, args.port)))
+    serving = loop.create_task(server.serve_forever())
+    try:
+        loop.run_until_complete(serving)
+    except KeyboardInterrupt:
+        serving.cancel()
+        try:
+            loop.run_until_complete(serving)
+        except asyncio.CancelledError:
+            pass
+    finally:
+        loop.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in profiling of the prediction stages and of the functional groups.
+
+Profiling is off by default. The instrumented functions only check whether a
+profiler is active, so the cost when disabled is one global lookup per call.
+Enable it for a block of code:
+
+    from profiling import profile
+    with profile() as profiler:
+        properties_batch(smiles_list)
+    print(profiler.summary())
+    profiler.to_json('profile.json')
+
+or for the lifetime of a worker with enable()/disable(). A metrics agent can
+pull the counters with snapshot(), or have them pushed with start_reporter().
+The stage times are inclusive: the time of a stage contains the time of the
+stages it calls.
+"""
+# -----------------------------------------------------------------------------
+import json
+import time
+import threading
+from functools import wraps
+from contextlib import contextmanager
+# -----------------------------------------------------------------------------
+
+# Profiler receiving the measurements, None when profiling is disabled
+active = None
+
+# -----------------------------------------------------------------------------
+class Profiler:
+# -----------------------------------------------------------------------------
+    ''' A class accumulating call counts and times.
+    This class has following attributes:
+        stages            - dictionary of [calls, seconds] per stage
+        functional_groups - dictionary of [calls, seconds] per functional group
+        clock             - function returning the time in seconds
+    '''
+    def __init__(self):
+        ''' Method to initialize the class '''
+        self.clock = time.perf_counter
+        self.stages = {}
+        self.functional_groups = {}
+        self._lock = threading.Lock()
+        self._started = time.time()
+
+    def add(self, stage, seconds, calls=1):
+        ''' Method adding the time of calls to a stage '''
+        with self._lock:
+            entry = self.stages.get(stage)
+            if entry is None:
+                self.stages[stage] = [calls, seconds]
+            else:
+                entry[0] += calls
+                entry[1] += seconds
+
+    def add_groups(self, timings):
+        ''' Method adding one call per functional group.
+        Inputs:
+            timings - list of (functional group key, seconds)
+        '''
+        with self._lock:
+            groups = self.functional_groups
+            for key, seconds in timings:
+                entry = groups.get(key)
+                if entry is None:
+                    groups[key] = [1, seconds]
+                else:
+                    entry[0] += 1
+                    entry[1] += seconds
+
+    @contextmanager
+    def stage(self, name):
+        ''' Context manager timing a block of code as a stage '''
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.add(name, self.clock() - start)
+
+    def reset(self):
+        ''' Method setting every counter to zero '''
+        with self._lock:
+            self.stages = {}
+            self.functional_groups = {}
+            self._started = time.time()
+
+    def snapshot(self, reset=False):
+        ''' Method returning a copy of the counters, safe to call from another
+        thread while predictions are running.
+        Optional inputs:
+            reset - set the counters to zero after copying, so consecutive
+                    snapshots hold the counts of disjoint periods
+        Output:
+            snapshot - dictionary with the stages and the functional groups,
+                       each entry holding calls, seconds and mean_us
+        '''
+        with self._lock:
+            snapshot = {'started': self._started, 'time': time.time(),
+                        'stages': _table(self.stages),
+                        'functional_groups': _table(self.functional_groups)}
+            if reset:
+                self.stages = {}
+                self.functional_groups = {}
+                self._started = snapshot['time']
+        return snapshot
+
+    def to_json(self, path=None):
+        ''' Method exporting the counters as JSON, to path when given.
+        Output:
+            text - JSON text of snapshot()
+        '''
+        text = json.dumps(self.snapshot(), indent=2)
+        if path is not None:
+            with open(path, 'w') as fp:
+                fp.write(text + '\n')
+        return text
+
+    def summary(self, limit=None):
+        ''' Method returning the counters as a table sorted by time.
+        Optional inputs:
+            limit - maximum number of functional groups listed
+        '''
+        snapshot = self.snapshot()
+        lines = []
+        for title, table in [('stage', snapshot['stages']), ('functional group', snapshot['functional_groups'])]:
+            rows = sorted(table.items(), key=lambda item: -item[1]['seconds'])
+            if title == 'functional group' and limit is not None:
+                rows = rows[:limit]
+            lines.append('%-28s %10s %12s %12s' % (title, 'calls', 'total ms', 'mean us'))
+            for name, entry in rows:
+                lines.append('%-28s %10d %12.3f %12.3f' % (name, entry['calls'], entry['seconds']*1e3,
+                                                         entry['mean_us']))
+            lines.append('')
+        return '\n'.join(lines)
+
+    def start_reporter(self, callback, interval=60.0, reset=True):
+        ''' Method calling callback(snapshot) every interval seconds from a
+        daemon thread, for pushing the counters to a metrics agent.
+        Output:
+            stop - threading.Event, set it to stop the reporter
+        '''
+        stop = threading.Event()
+
+        def report():
+            while not stop.wait(interval):
+                callback(self.snapshot(reset=reset))
+
+        threading.Thread(target=report, name='profiling-reporter', daemon=True).start()
+        return stop
+
+def _table(counters):
+    return {name: {'calls': calls, 'seconds': seconds, 'mean_us': 1e6*seconds/calls if calls else 0.0}
+            for name, (calls, seconds) in counters.items()}
+
+# -----------------------------------------------------------------------------
+def enable(profiler=None):
+# -----------------------------------------------------------------------------
+    ''' Function activating a profiler, a new one by default.
+    Output:
+            profiler - the active profiler
+    '''
+# -----------------------------------------------------------------------------
+    global active
+    active = Profiler() if profiler is None else profiler
+    return active
+
+def disable():
+    ''' Function deactivating profiling. Output: the profiler which was active '''
+    global active
+    profiler, active = active, None
+    return profiler
+
+@contextmanager
+def profile(profiler=None):
+    ''' Context manager activating a profiler, a new one by default, for a
+    block of code. The previously active profiler is restored at the end. '''
+    global active
+    previous = active
+    active = Profiler() if profiler is None else profiler
+    try:
+        yield active
+    finally:
+        active = previous
+
+# -----------------------------------------------------------------------------
+def timed(stage):
+# -----------------------------------------------------------------------------
+    ''' Decorator recording the calls of a function as a stage of the active
+    profiler. Without an active profiler the function is called directly. '''
+# -----------------------------------------------------------------------------
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            profiler = active
+            if profiler is None:
+                return fn(*args, **kwargs)
+            start = profiler.clock()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profiler.add(stage, profiler.clock() - start)
+        return wrapper
+    return decorate
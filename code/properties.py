@@ -5,84 +5,480 @@ Created on Thu Mar  1 11:47:15 2018
 @author: p.tagade
 """
 import os
+import math
 import numpy as np
 import json
 from extract_features import * 
+from substring_counter import SubstringCounter
+from profiling import timed
+from results import as_columns, as_records
 import platform
 
 # -----------------------------------------------------------------------------
-def properties(smiles, lumo=None, homo=None):
-# -----------------------------------------------------------------------------    
-    ''' Function for orbital energies and redox potentials prediction. 
-    The function accepts smiles of an organic molecule as input and provides 
-    orbital energies and redox potential as output. 
-    
-    Inputs: 
-            smiles - smiles representation of organic molecule
+# Limits used for scaling the predicted properties
+# -----------------------------------------------------------------------------
+property_limits = {}
+property_limits['oxidation'] = [-0.485437, 3.68406]
+property_limits['reduction'] = [-4.89283, 0.201063]
+property_limits['bandgap']   = [-9.06482453, -1.06047362]
+property_limits['lumo']      = [-3.91109452, 0.70178201]
+property_limits['homo']      = [-8.495, -4.625]
+
+# -----------------------------------------------------------------------------
+# Default file with the coefficients of the correlation
+# -----------------------------------------------------------------------------
+default_coefficients_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'coefficients.jsn')
+
+# -----------------------------------------------------------------------------
+# Loading coefficients of the correlation
+# -----------------------------------------------------------------------------
+@timed('load_coefficients')
+def load_coefficients(filepath=None):
+# -----------------------------------------------------------------------------
+    ''' Function for loading the coefficients of the correlation.
+
     Optional inputs:
-            lumo - Lowest Unoccopied Molecular Orbital Energy in eV.
-            homo - Highest Occuped Molecular Orbital Energy in eV.
+            filepath - path of the coefficients file, coefficients.jsn
+                       next to this module is used by default
     Output:
-            output_properties - A dictionary of output properties         
+            coefficients - A dictionary with a coefficient set per property
     '''
-# -----------------------------------------------------------------------------    
-    property_limits = {}
-    property_limits['oxidation'] = [-0.485437, 3.68406]
-    property_limits['reduction'] = [-4.89283, 0.201063]
-    property_limits['bandgap']   = [-9.06482453, -1.06047362]
-    property_limits['lumo']      = [-3.91109452, 0.70178201]
-    property_limits['homo']      = [-8.495, -4.625]
-# Output is sent in a dictionary
-    output_properties = {}
-# -----------------------------------------------------------------------------        
-    functional_groups = create_functional_groups()    
 # -----------------------------------------------------------------------------
-# Extracting features from SMILES representation
-# -----------------------------------------------------------------------------    
-    smiles_features = extract_features(smiles, functional_groups)    
-# ----------------------------------------------------------------------------- 
-# Loading coefficients of the correlation
+    if filepath is None:
+        filepath = default_coefficients_file
+    with open(filepath, 'r') as fp:
+        coefficients = json.load(fp)
+    return coefficients
+
+# -----------------------------------------------------------------------------
+class Predictor:
 # -----------------------------------------------------------------------------
-    filepath = os.path.join(os.path.dirname(__file__), 'coefficients.jsn')
+    ''' A class for orbital energies and redox potentials prediction.
+    The functional groups and the coefficients of the correlation are loaded
+    once, when the predictor is created, and reused by every prediction.
+    This class has following attributes:
+        coefficients_file - path of the coefficients file
+        coefficients      - correlation coefficients for each property
+        compiled          - coefficients compiled into dense weight arrays and
+                            per-feature lookup tables
+        functional_groups - dictionary of functional groups
+        feature_names     - feature plan: keys of the functional groups read
+                            by the coefficients, in extraction order
+        pruned_features   - keys of the functional groups skipped by the plan
+        counter           - counter of the substrings used by the feature plan
+        dedup_stats       - number of molecules, of distinct inputs and of
+                            distinct SMILES of the last predict_batch call,
+                            and the fraction of the work saved
+    '''
+    def __init__(self, coefficients_file=None):
+        ''' Method to initialize the class '''
+        if coefficients_file is None:
+            coefficients_file = default_coefficients_file
+        self.functional_groups = create_functional_groups()
+        self.limits = {key: np.array(property_limits[key]) for key in property_limits}
+        self.dedup_stats = None
+        self.scalar_limits = {key: tuple(float(value) for value in property_limits[key]) for key in property_limits}
+        self.reload(coefficients_file)
 
- 
-    with open(filepath, 'r') as fp:
-        coefficients = json.load(fp)            
-# -----------------------------------------------------------------------------    
+    def reload(self, coefficients_file=None):
+        ''' Method loading the coefficients, from coefficients_file or again
+        from the current file, and recomputing the feature plan. '''
+        if coefficients_file is not None:
+            self.coefficients_file = coefficients_file
+        self.set_coefficients(load_coefficients(self.coefficients_file))
+
+    def set_coefficients(self, coefficients):
+        ''' Method replacing the coefficients of the correlation. The
+        coefficients are compiled and the feature plan is recomputed, so only
+        the functional groups read by the new coefficients are extracted.
+        Inputs:
+            coefficients - A dictionary with a coefficient set per property
+        '''
+        self.coefficients = coefficients
+        self.feature_names, self.pruned_features, self.counter = plan_features(self.functional_groups,
+                                                                               coefficients.values())
+        self.compiled = {}
+        for key in coefficients:
+            self.compiled[key] = compile_lookup_tables(compile_coefficients(coefficients[key]),
+                                                       self.functional_groups, self.feature_names)
+
+    def features(self, smiles):
+        ''' Method for extracting the scaled features of a single molecule.
+        Inputs:
+            smiles - smiles representation of organic molecule
+        Output:
+            features - Dictionary with value of each feature
+        '''
+        return extract_features(smiles, self.functional_groups, self.counter, self.feature_names)
+
+    def count_vector(self, smiles):
+        ''' Method for counting the functional groups of a single molecule as
+        a row of the count matrix.
+        Inputs:
+            smiles - smiles representation of organic molecule
+        Output:
+            count_vector - list with a raw count per entry of feature_names
+        '''
+        return extract_count_vector(smiles, self.functional_groups, self.counter, self.feature_names)
+
+    def count_matrix(self, smiles_list):
+        ''' Method for counting the functional groups of a batch.
+        Inputs:
+            smiles_list - list of smiles representations of organic molecules
+        Output:
+            count_matrix - array with a row per molecule and a column per
+                           entry of feature_names
+        '''
+        return extract_count_matrix(smiles_list, self.functional_groups, self.counter, self.feature_names)
+
+    def predict(self, smiles, homo=None, lumo=None):
+        ''' Method for orbital energies and redox potentials prediction.
+        Inputs:
+            smiles - smiles representation of organic molecule
+        Optional inputs:
+            homo - Highest Occuped Molecular Orbital Energy in eV.
+            lumo - Lowest Unoccopied Molecular Orbital Energy in eV.
+        Output:
+            output_properties - A dictionary of output properties
+        '''
+        output_properties = self.predict_vector(self.count_vector(smiles), homo=homo, lumo=lumo)
+        if lumo is not None and lumo == lumo:
+            output_properties['lumo'] = lumo
+        if homo is not None and homo == homo:
+            output_properties['homo'] = homo
+        return output_properties
+
+    def predict_batch(self, smiles_list, homo=None, lumo=None, deduplicate=True):
+        ''' Method for orbital energies and redox potentials prediction for
+        a batch of molecules. The results agree with calling predict() on
+        every molecule within 1e-12 eV. Repeated inputs are scored once: the
+        features are extracted once per distinct SMILES string and predicted
+        once per distinct SMILES and HOMO/LUMO input. The results are
+        scattered back to every position and the savings are recorded in
+        dedup_stats, which is None after a call with deduplicate=False.
+        Inputs:
+            smiles_list - list of smiles representations of organic molecules
+        Optional inputs:
+            homo - Array of HOMO energies in eV, one for each molecule.
+                   NaN, None or masked entries are predicted.
+            lumo - Array of LUMO energies in eV, one for each molecule.
+                   NaN, None or masked entries are predicted.
+            deduplicate - score repeated inputs once, True by default
+        Output:
+            output_properties - A dictionary of output property arrays
+        '''
+        if not deduplicate:
+            self.dedup_stats = None
+            return self.predict_counts(self.count_matrix(smiles_list), homo=homo, lumo=lumo)
+        output, self.dedup_stats = predict_unique(self, smiles_list, homo, lumo)
+        return output
+
+    def predict_vector(self, count_vector, homo=None, lumo=None):
+        ''' Method for orbital energies and redox potentials prediction of a
+        single molecule from its count vector. The correlations are evaluated
+        on plain floats with predict_scalar, which avoids the cost of NumPy
+        calls on single values.
+        Inputs:
+            count_vector - list with a raw count per entry of feature_names
+        Optional inputs:
+            homo - Highest Occuped Molecular Orbital Energy in eV, predicted
+                   when None or NaN.
+            lumo - Lowest Unoccopied Molecular Orbital Energy in eV, predicted
+                   when None or NaN.
+        Output:
+            output_properties - A dictionary of output properties
+        '''
+        if lumo is not None:
+            lumo = float(lumo)
+            if lumo != lumo:
+                lumo = None
+        if homo is not None:
+            homo = float(homo)
+            if homo != homo:
+                homo = None
+        correlation = lambda inputs, key: predict_scalar(count_vector, self.compiled[key], inputs)
+        return predict_chain(correlation, self.scalar_limits, lumo, homo)
+
+    @timed('predict_counts')
+    def predict_counts(self, count_matrix, homo=None, lumo=None):
+        ''' Method for orbital energies and redox potentials prediction from
+        a count matrix built by count_matrix(). The contribution of every
+        feature is gathered from its lookup table. A single row is scored
+        by predict_vector.
+        Inputs:
+            count_matrix - array with a row per molecule
+        Optional inputs:
+            homo - Array of HOMO energies in eV, one for each molecule.
+                   NaN, None or masked entries are predicted.
+            lumo - Array of LUMO energies in eV, one for each molecule.
+                   NaN, None or masked entries are predicted.
+        Output:
+            output_properties - A dictionary of output property arrays
+        '''
+        lumo = measured_values(lumo)
+        homo = measured_values(homo)
+        if len(count_matrix) == 1:
+            output = self.predict_vector(np.asarray(count_matrix[0], dtype=float).tolist(),
+                                         homo=None if homo is None else homo[0],
+                                         lumo=None if lumo is None else lumo[0])
+            return {key: np.array([output[key]]) for key in output}
+        columns = lookup_indices(count_matrix, self.functional_groups, self.feature_names)
+        correlation = lambda inputs, key: predict_lookup(columns, self.compiled[key], inputs)
+        return predict_chain(correlation, self.limits, lumo, homo)
+
+# -----------------------------------------------------------------------------
+# Chaining the lumo, homo and redox correlations
+# -----------------------------------------------------------------------------
+def predict_chain(correlation, limits, lumo=None, homo=None):
+# -----------------------------------------------------------------------------
+    ''' Function chaining the lumo, homo and redox correlations. The scaled
+    lumo and homo are added to the inputs of the later stages.
+
+    Inputs:
+            correlation - function evaluating a coefficient set, called as
+                          correlation(inputs, key) with the dictionary of the
+                          scaled lumo and homo computed so far
+            limits - dictionary of the property limits
+    Optional inputs:
+            lumo, homo - measured values; arrays may hold NaN entries, which
+                         are filled with the predicted values
+    Output:
+            output_properties - A dictionary of output properties
+    '''
+# -----------------------------------------------------------------------------
+    features = {}
+    output_properties = {}
+# -----------------------------------------------------------------------------
 # Predicting lumo energy
 # -----------------------------------------------------------------------------
-    lim_lumo = np.array(property_limits['lumo'])
-    if lumo == None:        
-        lumo_coefs = coefficients['lumo']
-        lumo = predict(smiles_features, lumo_coefs)                
-        lumo = lumo*(lim_lumo[1] - lim_lumo[0]) + lim_lumo[0]
-    output_properties['lumo'] = lumo     
-    smiles_features['lumo'] = -2.0 + ((4.0)/(lim_lumo[1] - lim_lumo[0])) * (lumo - lim_lumo[0]);
-# -----------------------------------------------------------------------------    
+    lim_lumo = limits['lumo']
+    if lumo is None or has_missing(lumo):
+        predicted = correlation(features, 'lumo')
+        predicted = predicted*(lim_lumo[1] - lim_lumo[0]) + lim_lumo[0]
+        lumo = predicted if lumo is None else np.where(np.isnan(lumo), predicted, lumo)
+    output_properties['lumo'] = lumo
+    features['lumo'] = -2.0 + ((4.0)/(lim_lumo[1] - lim_lumo[0])) * (lumo - lim_lumo[0])
+# -----------------------------------------------------------------------------
 # Predicting homo energy
-# -----------------------------------------------------------------------------                           
-    lim_bandgap = np.array(property_limits['bandgap']) 
-        
-    if homo == None:        
-        homo_coefs = coefficients['homo']
-        bandgap = predict(smiles_features, homo_coefs)            
+# -----------------------------------------------------------------------------
+    lim_bandgap = limits['bandgap']
+    if homo is None or has_missing(homo):
+        bandgap = correlation(features, 'homo')
         bandgap = bandgap*(lim_bandgap[1] - lim_bandgap[0]) + lim_bandgap[0]
-        homo = bandgap + np.array(lumo)
-    output_properties['homo'] = homo     
-    lim_homo = np.array(property_limits['homo'])                  
-    smiles_features['homo'] = -2.0 + ((4.0)/(lim_homo[1] - lim_homo[0])) * (homo - lim_homo[0]);    
-# -----------------------------------------------------------------------------    
-# Redox potentials                    
+        homo = bandgap + lumo if homo is None else np.where(np.isnan(homo), bandgap + lumo, homo)
+    output_properties['homo'] = homo
+    lim_homo = limits['homo']
+    features['homo'] = -2.0 + ((4.0)/(lim_homo[1] - lim_homo[0])) * (homo - lim_homo[0])
+# -----------------------------------------------------------------------------
+# Redox potentials
 # -----------------------------------------------------------------------------
     for key in ['reduction', 'oxidation']:
-        prop = predict(smiles_features, coefficients[key])
-        lim = np.array(property_limits[key])
-        output_properties[key] = prop*(lim[1] - lim[0]) + lim[0] 
+        prop = correlation(features, key)
+        lim = limits[key]
+        output_properties[key] = prop*(lim[1] - lim[0]) + lim[0]
 
     return output_properties
-    
+
+# -----------------------------------------------------------------------------
+# Feature plan and functional group counts
+# -----------------------------------------------------------------------------
+def plan_features(functional_groups, coefficient_sets):
+# -----------------------------------------------------------------------------
+    ''' Function computing the feature plan of coefficient sets and the
+    counter of the substrings it uses.
+
+    Inputs:
+            functional_groups - dictionary of functional groups
+            coefficient_sets - coefficient sets of single properties, e.g.
+                               coefficients.values()
+    Output:
+            feature_names - keys of the functional groups read by the
+                            coefficients, in extraction order
+            pruned_features - keys of the functional groups skipped by the plan
+            counter - counter of the substrings used by the feature plan
+    '''
+# -----------------------------------------------------------------------------
+    feature_names = feature_plan(functional_groups, coefficient_sets)
+    pruned_features = [key for key in functional_groups if key not in feature_names]
+    counter = SubstringCounter(substring_patterns(functional_groups, feature_names))
+    return feature_names, pruned_features, counter
+
+def extract_count_vector(smiles, functional_groups, counter, feature_names):
+    ''' Function counting the functional groups of a single molecule as a
+    list with a raw count per entry of feature_names '''
+    group_counts = extract_counts(smiles, functional_groups, counter, feature_names)
+    return [group_counts[key] for key in feature_names]
+
+def extract_count_matrix(smiles_list, functional_groups, counter, feature_names):
+    ''' Function counting the functional groups of a batch as an array with
+    a row per molecule and a column per entry of feature_names '''
+    count_matrix = np.empty((len(smiles_list), len(feature_names)))
+    for i, smiles in enumerate(smiles_list):
+        count_matrix[i] = extract_count_vector(smiles, functional_groups, counter, feature_names)
+    return count_matrix
+
+# -----------------------------------------------------------------------------
+# Measured HOMO/LUMO inputs
+# -----------------------------------------------------------------------------
+def measured_values(values):
+    ''' Function converting measured HOMO or LUMO values to a float array.
+    None entries and masked entries of a numpy.ma array become NaN, the
+    marker of the values to be predicted. None is returned unchanged. '''
+    if values is None:
+        return None
+    if np.ma.isMaskedArray(values):
+        return np.ma.filled(values.astype(float), np.nan)
+    return np.asarray(values, dtype=float)
+
+def has_missing(values):
+    ''' Function returning True when an array of measured values has NaN
+    entries to be predicted '''
+    return isinstance(values, np.ndarray) and bool(np.isnan(values).any())
+
+# -----------------------------------------------------------------------------
+# Collapsing repeated inputs of a batch
 # -----------------------------------------------------------------------------
-# Predicting the properties using correlation. 
+def unique_inputs(smiles_list, homo=None, lumo=None):
+# -----------------------------------------------------------------------------
+    ''' Function finding the distinct inputs of a batch. An input is the
+    exact SMILES string and its HOMO/LUMO values, NaN standing for a value to
+    be predicted. The SMILES are not normalised: whitespace, for instance,
+    changes the chain end features, so only identical strings are merged.
+
+    Inputs:
+            smiles_list - list of smiles representations of organic molecules
+    Optional inputs:
+            homo, lumo - float arrays of measured values, see measured_values
+    Output:
+            first - position of the first occurrence of every distinct input
+            inverse - array with the distinct input of every position
+            smiles_rows - array with the distinct SMILES of every distinct input
+            unique_smiles - list of the distinct SMILES
+    '''
+# -----------------------------------------------------------------------------
+    n = len(smiles_list)
+    homo_list = [None]*n if homo is None else [None if value != value else value for value in homo.tolist()]
+    lumo_list = [None]*n if lumo is None else [None if value != value else value for value in lumo.tolist()]
+    inputs = {}
+    smiles_index = {}
+    first = []
+    smiles_rows = []
+    inverse = np.empty(n, dtype=np.intp)
+    for i, smiles in enumerate(smiles_list):
+        key = (smiles, homo_list[i], lumo_list[i])
+        j = inputs.get(key)
+        if j is None:
+            j = inputs[key] = len(first)
+            first.append(i)
+            smiles_rows.append(smiles_index.setdefault(smiles, len(smiles_index)))
+        inverse[i] = j
+    return first, inverse, np.array(smiles_rows, dtype=np.intp), list(smiles_index)
+
+# -----------------------------------------------------------------------------
+def predict_unique(model, smiles_list, homo=None, lumo=None):
+# -----------------------------------------------------------------------------
+    ''' Function scoring the distinct inputs of a batch once and scattering
+    the results back to every position.
+
+    Inputs:
+            model - object with the count_matrix and predict_counts methods
+                    of Predictor, e.g. a Predictor or a ModelRegistry
+            smiles_list - list of smiles representations of organic molecules
+    Optional inputs:
+            homo, lumo - arrays of measured values, NaN, None or masked
+                         entries are predicted
+    Output:
+            (output_properties, dedup_stats) - the outputs of predict_counts
+                         for every position, and the number of molecules,
+                         distinct inputs and distinct SMILES with the
+                         fraction of the work saved
+    '''
+# -----------------------------------------------------------------------------
+    homo = measured_values(homo)
+    lumo = measured_values(lumo)
+    first, inverse, smiles_rows, unique_smiles = unique_inputs(smiles_list, homo, lumo)
+    n = len(smiles_list)
+    dedup_stats = {'molecules': n, 'unique_inputs': len(first), 'unique_smiles': len(unique_smiles),
+                   'ratio': 1.0 - len(first)/n if n else 0.0}
+    count_matrix = model.count_matrix(unique_smiles)[smiles_rows]
+    output = model.predict_counts(count_matrix, homo=None if homo is None else homo[first],
+                                  lumo=None if lumo is None else lumo[first])
+    return scatter(output, inverse), dedup_stats
+
+def scatter(output, inverse):
+    ''' Function expanding the arrays of a (nested) dictionary of outputs of
+    the distinct inputs back to every position of the batch '''
+    if isinstance(output, dict):
+        return {key: scatter(value, inverse) for key, value in output.items()}
+    return np.asarray(output)[inverse]
+
+# -----------------------------------------------------------------------------
+# Shared predictor used by the module level functions
+# -----------------------------------------------------------------------------
+_shared_predictor = None
+
+def shared_predictor():
+    ''' Function returning the predictor shared by properties() and
+    properties_batch(). It is created on first use. '''
+    global _shared_predictor
+    if _shared_predictor is None:
+        _shared_predictor = Predictor()
+    return _shared_predictor
+
+# -----------------------------------------------------------------------------
+@timed('properties')
+def properties(smiles, lumo=None, homo=None):
+# -----------------------------------------------------------------------------
+    ''' Function for orbital energies and redox potentials prediction.
+    The function accepts smiles of an organic molecule as input and provides
+    orbital energies and redox potential as output.
+
+    Inputs:
+            smiles - smiles representation of organic molecule
+    Optional inputs:
+            lumo - Lowest Unoccopied Molecular Orbital Energy in eV.
+            homo - Highest Occuped Molecular Orbital Energy in eV.
+    Output:
+            output_properties - A dictionary of output properties
+    '''
+# -----------------------------------------------------------------------------
+    return shared_predictor().predict(smiles, homo=homo, lumo=lumo)
+
+# -----------------------------------------------------------------------------
+@timed('properties_batch')
+def properties_batch(smiles_list, lumo=None, homo=None, layout='columns', dtype=None):
+# -----------------------------------------------------------------------------
+    ''' Function for orbital energies and redox potentials prediction for a
+    batch of molecules. The features of all the molecules are assembled in a
+    single N x F matrix and the correlations are evaluated as whole-array
+    operations. The results agree with calling properties() on every
+    molecule to within 1e-12 eV.
+
+    Inputs:
+            smiles_list - list of smiles representations of organic molecules
+    Optional inputs:
+            lumo - Array of LUMO energies in eV, one for each molecule.
+                   NaN, None or masked entries are predicted.
+            homo - Array of HOMO energies in eV, one for each molecule.
+                   NaN, None or masked entries are predicted.
+            layout - 'columns' for a dictionary of property arrays, 'records'
+                     for a structured array with a record per molecule
+            dtype - float type of the results, e.g. np.float32; float64
+                    by default
+    Output:
+            output_properties - A dictionary of output property arrays, or a
+                                structured array (see results.as_records)
+    '''
+# -----------------------------------------------------------------------------
+    output = shared_predictor().predict_batch(smiles_list, homo=homo, lumo=lumo)
+    if layout == 'records':
+        return as_records(output, dtype='float64' if dtype is None else dtype)
+    if layout != 'columns':
+        raise ValueError('unknown layout %r' % layout)
+    return output if dtype is None else as_columns(output, dtype)
+
+# -----------------------------------------------------------------------------
+# Predicting the properties using correlation.
 # -----------------------------------------------------------------------------            
 def predict(input_features, coefs):
 # -----------------------------------------------------------------------------    
@@ -104,6 +500,193 @@ def predict(input_features, coefs):
             c = np.array(coefs[key])            
             prop = prop + c[0]*x + c[1]*hyperbolic_tan(x) + c[2]*sigmoid(x)
     return prop
+
+# -----------------------------------------------------------------------------
+# Compiling the correlation coefficients into dense arrays
+# -----------------------------------------------------------------------------
+def compile_coefficients(coefs):
+# -----------------------------------------------------------------------------
+    ''' Function for compiling a set of correlation coefficients into dense
+    weight arrays.
+
+    Inputs:
+            coefs - correlation coefficients
+    Output:
+            compiled - A dictionary with the bias, the ordered feature keys
+                       and a (3, F) array with the linear, tanh and sigmoid
+                       weights of each feature
+    '''
+# -----------------------------------------------------------------------------
+    keys = [key for key in coefs.keys() if key != 'bias']
+    weights = np.array([coefs[key] for key in keys], dtype=float).reshape(len(keys), 3)
+    return {'bias': np.array(coefs['bias'], dtype=float), 'keys': keys, 'weights': weights.T.copy()}
+
+# -----------------------------------------------------------------------------
+# Range of the lookup table of a functional group
+# -----------------------------------------------------------------------------
+def table_range(group):
+# -----------------------------------------------------------------------------
+    ''' Function returning the first count and the number of entries of the
+    lookup table of a functional group, covering min_val to max_val. '''
+# -----------------------------------------------------------------------------
+    first = int(np.ceil(group.min_val))
+    return first, int(np.floor(group.max_val)) - first + 1
+
+# -----------------------------------------------------------------------------
+# Compiling the correlation into per-feature lookup tables
+# -----------------------------------------------------------------------------
+def compile_lookup_tables(compiled, functional_groups, feature_names):
+# -----------------------------------------------------------------------------
+    ''' Function for tabulating the contribution of every feature. A feature
+    computed from a functional group only depends on its integer count, so
+    its contribution c0*x + c1*tanh(x) + c2*sigmoid(x) is evaluated once for
+    every count between min_val and max_val of the functional group.
+
+    Inputs:
+            compiled - correlation coefficients compiled by compile_coefficients
+            functional_groups - dictionary of functional groups
+            feature_names - keys of the columns of the count matrix
+    Output:
+            compiled - the compiled coefficients with a 'lookup' list of
+                       (column, table, c0, c1, c2, min_val, max_val) for the
+                       functional groups and a 'direct' list of
+                       (key, c0, c1, c2) for the continuous lumo and homo;
+                       'scalar', 'scalar_direct' and 'scalar_bias' hold the
+                       same data as plain Python floats for predict_scalar
+    '''
+# -----------------------------------------------------------------------------
+    c0, c1, c2 = compiled['weights']
+    lookup = []
+    direct = []
+    for j, key in enumerate(compiled['keys']):
+        if key not in functional_groups:
+            direct.append((key, c0[j], c1[j], c2[j]))
+            continue
+        group = functional_groups[key]
+        first, size = table_range(group)
+        count = np.arange(first, first + size, dtype=float)
+        x = -2.0 + ((4.0)/(group.max_val - group.min_val)) * (count - group.min_val)
+        table = c0[j]*x + c1[j]*hyperbolic_tan(x) + c2[j]*sigmoid(x)
+        lookup.append((feature_names.index(key), table, c0[j], c1[j], c2[j], group.min_val, group.max_val))
+    compiled['lookup'] = lookup
+    compiled['direct'] = direct
+    compiled['scalar_bias'] = float(compiled['bias'])
+    compiled['scalar'] = tuple((j, table.tolist(), table_range(functional_groups[feature_names[j]])[0],
+                                float(c0), float(c1), float(c2), float(min_val), float(max_val))
+                               for j, table, c0, c1, c2, min_val, max_val in lookup)
+    compiled['scalar_direct'] = tuple((key, float(c0), float(c1), float(c2)) for key, c0, c1, c2 in direct)
+    return compiled
+
+# -----------------------------------------------------------------------------
+# Indexing raw counts into the lookup tables
+# -----------------------------------------------------------------------------
+@timed('lookup_indices')
+def lookup_indices(count_matrix, functional_groups, feature_names):
+# -----------------------------------------------------------------------------
+    ''' Function converting a count matrix into lookup table indices. The
+    indices only depend on the functional groups, so they are computed once
+    and shared by every coefficient set.
+
+    Inputs:
+            count_matrix - array of raw counts with a row per molecule and a
+                           column per entry of feature_names
+            functional_groups - dictionary of functional groups
+            feature_names - keys of the columns of the count matrix
+    Output:
+            columns - list of (index, outside, count) per column: the table
+                      indices, a mask of the counts outside the table (None
+                      when every count is inside) and the raw counts
+    '''
+# -----------------------------------------------------------------------------
+    counts = np.ascontiguousarray(np.asarray(count_matrix, dtype=float).T)
+    index = counts.astype(np.intp)
+    columns = []
+    for j, key in enumerate(feature_names):
+        first, size = table_range(functional_groups[key])
+        column = index[j] - first
+        outside = (column < 0) | (column >= size) | (index[j] != counts[j])
+        if outside.any():
+            np.clip(column, 0, size - 1, out=column)
+        else:
+            outside = None
+        columns.append((column, outside, counts[j]))
+    return columns
+
+# -----------------------------------------------------------------------------
+# Predicting the properties of a batch from raw counts.
+# -----------------------------------------------------------------------------
+@timed('correlation')
+def predict_lookup(columns, compiled, inputs=None):
+# -----------------------------------------------------------------------------
+    ''' Function for predicting the value of the correlation from the raw
+    functional group counts. The contributions are gathered from the lookup
+    tables built by compile_lookup_tables, so no transcendental function is
+    evaluated for counts inside the tables. Counts outside a table, and the
+    continuous lumo and homo inputs, are evaluated directly.
+
+    Inputs:
+            columns - table indices built by lookup_indices
+            compiled - correlation coefficients with lookup tables
+    Optional inputs:
+            inputs - dictionary with the scaled lumo and homo arrays
+    Output:
+            prop - array of predictions from the correlation
+    '''
+# -----------------------------------------------------------------------------
+    prop = compiled['bias']
+    for j, table, c0, c1, c2, min_val, max_val in compiled['lookup']:
+        index, outside, count = columns[j]
+        term = table[index]
+        if outside is not None:
+            x = -2.0 + ((4.0)/(max_val - min_val)) * (count[outside] - min_val)
+            term[outside] = c0*x + c1*hyperbolic_tan(x) + c2*sigmoid(x)
+        prop = prop + term
+    for key, c0, c1, c2 in compiled['direct']:
+        x = inputs[key]
+        prop = prop + (c0*x + c1*hyperbolic_tan(x) + c2*sigmoid(x))
+    return prop
+
+# -----------------------------------------------------------------------------
+# Predicting the properties of a single molecule from raw counts.
+# -----------------------------------------------------------------------------
+def predict_scalar(counts, compiled, inputs=None):
+# -----------------------------------------------------------------------------
+    ''' Function for predicting the value of the correlation for a single
+    molecule. It follows predict_lookup on plain Python floats: the
+    contributions are read from the lookup tables stored as lists, and the
+    counts outside a table and the lumo and homo inputs are evaluated with
+    the math module.
+
+    Inputs:
+            counts - list of raw counts, one per entry of feature_names
+            compiled - correlation coefficients with lookup tables
+    Optional inputs:
+            inputs - dictionary with the scaled lumo and homo
+    Output:
+            prop - prediction from the correlation
+    '''
+# -----------------------------------------------------------------------------
+    prop = compiled['scalar_bias']
+    for j, table, first, c0, c1, c2, min_val, max_val in compiled['scalar']:
+        count = counts[j]
+        index = int(count) - first
+        if 0 <= index < len(table) and index + first == count:
+            prop = prop + table[index]
+        else:
+            x = -2.0 + ((4.0)/(max_val - min_val)) * (count - min_val)
+            prop = prop + (c0*x + c1*math.tanh(x) + c2*scalar_sigmoid(x))
+    for key, c0, c1, c2 in compiled['scalar_direct']:
+        x = inputs[key]
+        prop = prop + (c0*x + c1*math.tanh(x) + c2*scalar_sigmoid(x))
+    return prop
+
+def scalar_sigmoid(x):
+    ''' Function returning the sigmoid of a float, 0.0 where exp(-x) overflows '''
+    try:
+        return 1.0/(1.0 + math.exp(-x))
+    except OverflowError:
+        return 0.0
+
 # -----------------------------------------------------------------------------
 # Sigmoid function
 # -----------------------------------------------------------------------------
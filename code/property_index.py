@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+Range index over predicted properties.
+
+Scored molecules are added to the index in chunks. Every chunk becomes a
+sorted run holding, for each property, the values in sorted order and the
+permutation which sorts them. Window queries bisect every run on the most
+selective property and check the other properties on the few candidates
+only; top-k queries read the ends of the sorted runs. Runs of similar size
+are merged as chunks are added, so there are O(log n) runs and adding a
+chunk never rebuilds the whole index. The runs are saved as .npy files and
+opened with np.memmap.
+
+Usage (from the code directory):
+    python -m property_index add library.index predictions.csv
+    python -m property_index query library.index --range oxidation:1.0:1.5 --range reduction:-3:-2
+    python -m property_index query library.index --top oxidation:10
+"""
+# -----------------------------------------------------------------------------
+import os
+import sys
+import csv
+import json
+import argparse
+import numpy as np
+# -----------------------------------------------------------------------------
+
+# Properties held by the index
+indexed_properties = ['homo', 'lumo', 'oxidation', 'reduction']
+
+# Fields of a row of a run
+row_dtype = np.dtype([('id', '<i8')] + [(key, '<f8') for key in indexed_properties])
+
+# -----------------------------------------------------------------------------
+class Run:
+# -----------------------------------------------------------------------------
+    ''' A sorted run of the index.
+    This class has following attributes:
+        rows   - structured array with the id and the properties of each row
+        order  - (P, n) array, row positions sorting each property
+        values - (P, n) array, each property in sorted order
+        valid  - number of values of each property which are not NaN
+    '''
+    def __init__(self, rows, order=None, values=None):
+        ''' Method to initialize the class; the sort is computed when order
+        and values are not given '''
+        self.rows = rows
+        if order is None:
+            order = np.array([np.argsort(rows[key], kind='stable') for key in indexed_properties],
+                             dtype='<i8').reshape(len(indexed_properties), len(rows))
+            values = np.array([rows[key][order[p]] for p, key in enumerate(indexed_properties)],
+                              dtype='<f8').reshape(len(indexed_properties), len(rows))
+        self.order = order
+        self.values = values
+        self.valid = [int(np.searchsorted(self.values[p], np.nan, 'left')) for p in range(len(indexed_properties))]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def window(self, p, low, high):
+        ''' Method returning the slice of sorted positions of property p in
+        [low, high]; None bounds are open '''
+        values = self.values[p]
+        start = 0 if low is None else int(np.searchsorted(values, low, 'left'))
+        stop = self.valid[p] if high is None else min(int(np.searchsorted(values, high, 'right')), self.valid[p])
+        return start, max(start, stop)
+
+    @staticmethod
+    def load(prefix):
+        ''' Method opening a run saved by save() '''
+        return Run(np.load(prefix + '-rows.npy', mmap_mode='r'), np.load(prefix + '-order.npy', mmap_mode='r'),
+                   np.load(prefix + '-values.npy', mmap_mode='r'))
+
+    def save(self, prefix):
+        ''' Method saving the run to three .npy files '''
+        np.save(prefix + '-rows.npy', self.rows)
+        np.save(prefix + '-order.npy', self.order)
+        np.save(prefix + '-values.npy', self.values)
+
+# -----------------------------------------------------------------------------
+class PropertyIndex:
+# -----------------------------------------------------------------------------
+    ''' A class indexing predicted properties for window and top-k queries.
+    This class has following attributes:
+        path - directory where the index is saved, None for an in-memory index
+        runs - list of sorted runs, from the oldest to the newest
+    '''
+    def __init__(self, path=None):
+        ''' Method to initialize the class. An index saved in path is opened. '''
+        self.path = path
+        self.runs = []
+        self._names = []
+        self._next = 0
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            manifest_path = os.path.join(path, 'index.json')
+            if os.path.exists(manifest_path):
+                with open(manifest_path, 'r') as fp:
+                    manifest = json.load(fp)
+                self._names = manifest['runs']
+                self._next = manifest['next']
+                self.runs = [Run.load(os.path.join(path, name)) for name in self._names]
+
+    def __len__(self):
+        return sum(len(run) for run in self.runs)
+
+    def append(self, ids, output_properties):
+        ''' Method adding scored molecules to the index.
+        Inputs:
+            ids - integer ids of the molecules, e.g. line numbers
+            output_properties - dictionary of property arrays, as returned by
+                                properties_batch
+        '''
+        ids = np.asarray(ids, dtype='<i8').reshape(-1)
+        rows = np.empty(len(ids), dtype=row_dtype)
+        rows['id'] = ids
+        for key in indexed_properties:
+            rows[key] = np.asarray(output_properties[key], dtype=float).reshape(-1)
+        if not len(rows):
+            return
+        self.runs.append(Run(rows))
+        self._names.append(self._new_name())
+        removed = []
+# Merging the newest runs while they are of similar size
+        while len(self.runs) > 1 and len(self.runs[-2]) <= 2*len(self.runs[-1]):
+            newer = self.runs.pop()
+            older = self.runs.pop()
+            removed += [self._names.pop(), self._names.pop()]
+            self.runs.append(Run(np.concatenate([older.rows, newer.rows])))
+            self._names.append(self._new_name())
+        self._save(removed)
+
+    def compact(self):
+        ''' Method merging every run into one '''
+        if len(self.runs) > 1:
+            rows = np.concatenate([run.rows for run in self.runs])
+            removed = self._names
+            self.runs = [Run(rows)]
+            self._names = [self._new_name()]
+            self._save(removed)
+
+    def _new_name(self):
+        self._next += 1
+        return 'run-%06d' % self._next
+
+    def _save(self, removed):
+        if self.path is None:
+            return
+        saved = set()
+        for name, run in zip(self._names, self.runs):
+            prefix = os.path.join(self.path, name)
+            if not os.path.exists(prefix + '-values.npy'):
+                run.save(prefix)
+                saved.add(name)
+        manifest_path = os.path.join(self.path, 'index.json')
+        with open(manifest_path + '.part', 'w') as fp:
+            json.dump({'runs': self._names, 'next': self._next, 'count': len(self)}, fp)
+        os.replace(manifest_path + '.part', manifest_path)
+# Runs written by this call are reopened as memory maps
+        for i, name in enumerate(self._names):
+            if name in saved:
+                self.runs[i] = Run.load(os.path.join(self.path, name))
+        for name in removed:
+            for suffix in ['-rows.npy', '-order.npy', '-values.npy']:
+                if os.path.exists(os.path.join(self.path, name + suffix)):
+                    os.remove(os.path.join(self.path, name + suffix))
+
+    def query(self, ranges):
+        ''' Method returning the molecules with every property in its window.
+        Inputs:
+            ranges - dictionary of (low, high) bounds keyed by property; the
+                     bounds are inclusive and None is an open bound. A NaN
+                     value is in no window, even a fully open one.
+        Output:
+            ids - array of the ids of the matching molecules
+        '''
+        windows = [(indexed_properties.index(key), low, high) for key, (low, high) in ranges.items()]
+        if not windows:
+            return np.concatenate([np.asarray(run.rows['id']) for run in self.runs] + [np.zeros(0, '<i8')])
+        found = []
+        for run in self.runs:
+            bounds = [(p, low, high, run.window(p, low, high)) for p, low, high in windows]
+            p, _, _, (start, stop) = min(bounds, key=lambda bound: bound[3][1] - bound[3][0])
+            positions = np.sort(run.order[p][start:stop])
+            rows = run.rows[positions]
+            keep = np.ones(len(rows), dtype=bool)
+            for q, low, high, _ in bounds:
+                if q != p:
+                    column = rows[indexed_properties[q]]
+                    keep &= ~np.isnan(column)
+                    if low is not None:
+                        keep &= column >= low
+                    if high is not None:
+                        keep &= column <= high
+            found.append(rows['id'][keep])
+        return np.concatenate(found + [np.zeros(0, '<i8')])
+
+    def top_k(self, key, k, largest=True, ranges=None):
+        ''' Method returning the k molecules with the largest, or smallest,
+        value of a property.
+        Inputs:
+            key - property to rank
+            k - number of molecules
+        Optional inputs:
+            largest - rank from the largest value when True
+            ranges - windows the molecules must be in, as for query()
+        Output:
+            (ids, values) - arrays of ids and values, best first
+        '''
+        p = indexed_properties.index(key)
+        ids = []
+        values = []
+        for run in self.runs:
+            start, stop = run.window(p, None, None)
+            if ranges:
+                low, high = ranges.get(key, (None, None))
+                start, stop = run.window(p, low, high)
+                others = {name: bound for name, bound in ranges.items() if name != key}
+            else:
+                others = {}
+# Reading sorted positions from the best end until k rows pass the windows
+            step = max(k, 1)
+            taken = 0
+            kept = 0
+            while kept < k and taken < stop - start:
+                if largest:
+                    chunk = run.order[p][max(start, stop - taken - step):stop - taken][::-1]
+                else:
+                    chunk = run.order[p][start + taken:min(stop, start + taken + step)]
+                taken += len(chunk)
+                rows = run.rows[chunk]
+                keep = np.ones(len(rows), dtype=bool)
+                for name, (low, high) in others.items():
+                    keep &= ~np.isnan(rows[name])
+                    if low is not None:
+                        keep &= rows[name] >= low
+                    if high is not None:
+                        keep &= rows[name] <= high
+                ids.append(rows['id'][keep])
+                values.append(rows[key][keep])
+                kept += int(keep.sum())
+                step *= 2
+        ids = np.concatenate(ids + [np.zeros(0, '<i8')])
+        values = np.concatenate(values + [np.zeros(0)])
+        best = np.argsort(-values if largest else values, kind='stable')[:k]
+        return ids[best], values[best]
+
+# -----------------------------------------------------------------------------
+def read_predictions(path):
+# -----------------------------------------------------------------------------
+    ''' Function reading the ids and properties of a CSV or JSON lines file
+    written by screen.py; the line column is used as id. '''
+# -----------------------------------------------------------------------------
+    with open(path, 'r', newline='') as fp:
+        first = fp.readline()
+        fp.seek(0)
+        if first.startswith('{'):
+            records = [json.loads(line) for line in fp if line.strip()]
+        else:
+            records = list(csv.DictReader(fp))
+    ids = [int(record['line']) for record in records]
+    return ids, {key: [float(record[key]) for record in records] for key in indexed_properties}
+
+# -----------------------------------------------------------------------------
+def parse_range(text):
+# -----------------------------------------------------------------------------
+    ''' Function parsing a property:low:high window, an empty bound is open '''
+# -----------------------------------------------------------------------------
+    key, low, high = text.split(':')
+    if key not in indexed_properties:
+        raise argparse.ArgumentTypeError('unknown property %r' % key)
+    return key, (float(low) if low else None, float(high) if high else None)
+
+# -----------------------------------------------------------------------------
+def main(argv=None):
+# -----------------------------------------------------------------------------
+    ''' Command line entry point '''
+# -----------------------------------------------------------------------------
+    parser = argparse.ArgumentParser(description='Index predicted properties for window and top-k queries.')
+    commands = parser.add_subparsers(dest='command')
+    add = commands.add_parser('add', help='add the predictions of screen.py output files to the index')
+    add.add_argument('index', help='directory of the index')
+    add.add_argument('predictions', nargs='+', help='CSV or JSON lines files written by screen.py')
+    query = commands.add_parser('query', help='print the ids of the molecules in windows or the top-k')
+    query.add_argument('index', help='directory of the index')
+    query.add_argument('--range', action='append', type=parse_range, default=[],
+                       help='window property:low:high, e.g. oxidation:1.0:1.5; repeat for more properties')
+    query.add_argument('--top', default=None, help='property:k, the k largest values of the property')
+    query.add_argument('--bottom', default=None, help='property:k, the k smallest values of the property')
+    query.add_argument('--compact', action='store_true', help='merge the runs of the index first')
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.error('a command is required (add, query)')
+
+    index = PropertyIndex(args.index)
+    if args.command == 'add':
+        for path in args.predictions:
+            index.append(*read_predictions(path))
+        sys.stderr.write('index holds %d molecules in %d runs\n' % (len(index), len(index.runs)))
+        return 0
+
+    if args.compact:
+        index.compact()
+    ranges = dict(args.range)
+    if args.top is not None or args.bottom is not None:
+        key, k = (args.top or args.bottom).split(':')
+        ids, values = index.top_k(key, int(k), largest=args.top is not None, ranges=ranges)
+        for i, value in zip(ids.tolist(), values.tolist()):
+            sys.stdout.write('%d\t%r\n' % (i, value))
+    else:
+        for i in np.sort(index.query(ranges)).tolist():
+            sys.stdout.write('%d\n' % i)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Compact columnar storage of predicted properties.
+
+A batch of predictions is held either as separate float columns or as one
+NumPy structured array with a record per molecule: an int64 id, e.g. the line
+number, followed by the four properties as float64 (40 bytes per molecule) or
+float32 (24 bytes per molecule). Structured arrays are saved as .npy files,
+columns as .npz files, and both are read back with np.load.
+
+Results of long runs are appended chunk by chunk to a .npy file with
+ResultArrayWriter. The header of the file reserves room for the row count and
+is rewritten after every chunk, so the file is always a valid .npy array of
+the rows written so far and can be opened with np.load(path, mmap_mode='r').
+
+Usage (from the code directory):
+    python -m screen library.smi --format npy -o predictions.npy
+    python -m screen library.smi --format npy --dtype float32 -o predictions.npy
+"""
+# -----------------------------------------------------------------------------
+import os
+import struct
+import numpy as np
+# -----------------------------------------------------------------------------
+
+# Properties stored for every molecule
+result_properties = ['homo', 'lumo', 'oxidation', 'reduction']
+
+# Magic string of the version 1.0 .npy format
+npy_magic = b'\x93NUMPY\x01\x00'
+
+# -----------------------------------------------------------------------------
+def result_dtype(dtype='float64', ids=True):
+# -----------------------------------------------------------------------------
+    ''' Function returning the structured dtype of a result record.
+
+    Optional inputs:
+            dtype - float type of the properties, float64 or float32
+            ids - include the int64 'id' field when True
+    Output:
+            dtype - little-endian structured dtype
+    '''
+# -----------------------------------------------------------------------------
+    float_type = np.dtype(dtype).newbyteorder('<')
+    if float_type.kind != 'f':
+        raise ValueError('results must be stored as floats, got %s' % float_type)
+    fields = [('id', '<i8')] if ids else []
+    return np.dtype(fields + [(key, float_type) for key in result_properties])
+
+# -----------------------------------------------------------------------------
+def as_columns(output_properties, dtype='float64'):
+# -----------------------------------------------------------------------------
+    ''' Function converting a dictionary of property arrays, as returned by
+    properties_batch, to contiguous columns of the given float type. '''
+# -----------------------------------------------------------------------------
+    return {key: np.ascontiguousarray(output_properties[key], dtype=dtype).reshape(-1)
+            for key in result_properties}
+
+# -----------------------------------------------------------------------------
+def as_records(output_properties, ids=None, dtype='float64'):
+# -----------------------------------------------------------------------------
+    ''' Function converting a dictionary of property arrays to a structured
+    array with a record per molecule.
+
+    Inputs:
+            output_properties - dictionary of property arrays, as returned by
+                                properties_batch
+    Optional inputs:
+            ids - integer ids of the molecules; the records have no id field
+                  when not given
+            dtype - float type of the properties, float64 or float32
+    Output:
+            records - structured array of dtype result_dtype(dtype, ids)
+    '''
+# -----------------------------------------------------------------------------
+    n = len(np.asarray(output_properties[result_properties[0]]).reshape(-1))
+    records = np.empty(n, dtype=result_dtype(dtype, ids is not None))
+    if ids is not None:
+        records['id'] = np.asarray(ids, dtype='<i8').reshape(-1)
+    for key in result_properties:
+        records[key] = np.asarray(output_properties[key]).reshape(-1)
+    return records
+
+# -----------------------------------------------------------------------------
+def save_results(path, output_properties, ids=None, dtype='float64'):
+# -----------------------------------------------------------------------------
+    ''' Function saving a batch of predictions: a .npz path receives one
+    array per property (and 'id'), any other path a .npy structured array.
+    '''
+# -----------------------------------------------------------------------------
+    if path.endswith('.npz'):
+        columns = as_columns(output_properties, dtype)
+        if ids is not None:
+            columns['id'] = np.asarray(ids, dtype='<i8').reshape(-1)
+        np.savez(path, **columns)
+    else:
+        np.save(path, as_records(output_properties, ids, dtype))
+
+# -----------------------------------------------------------------------------
+class ResultArrayWriter:
+# -----------------------------------------------------------------------------
+    ''' A class appending result records to a .npy file.
+    This class has following attributes:
+        path  - path of the .npy file
+        dtype - structured dtype of the records, see result_dtype
+        count - number of records in the file
+    The header is rewritten after every write. With append=True the records
+    of an existing file are kept, and rows past its header count, left by an
+    interrupted run, are dropped.
+    '''
+    def __init__(self, path, dtype=None, append=False):
+        ''' Method to initialize the class '''
+        self.path = path
+        self.dtype = result_dtype() if dtype is None else np.dtype(dtype)
+        self.count = 0
+        self._offset = None
+        if append and os.path.exists(path):
+            with open(path, 'rb') as fp:
+                version = np.lib.format.read_magic(fp)
+                if version != (1, 0):
+                    raise ValueError('%s: only version 1.0 .npy files can be appended to' % path)
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(fp)
+                self._offset = fp.tell()
+            if dtype != self.dtype or len(shape) != 1:
+                raise ValueError('%s holds %s records of shape %s, expected %s'
+                                 % (path, dtype, shape, self.dtype))
+            self.count = shape[0]
+            self._fp = open(path, 'r+b')
+            self._fp.truncate(self._offset + self.count*self.dtype.itemsize)
+        else:
+            self._offset = len(self._header(10**20))
+            self._fp = open(path, 'w+b')
+            self._fp.write(self._header(0))
+        self._fp.seek(0, os.SEEK_END)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _header(self, count):
+        ''' Method returning the .npy header for count records, padded to the
+        size of the file's header so it can be rewritten in place '''
+        header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" \
+                 % (np.lib.format.dtype_to_descr(self.dtype), count)
+        size = self._offset
+        if size is None:
+            size = -(-(len(npy_magic) + 2 + len(header) + 1) // 64)*64
+        padding = size - len(npy_magic) - 2 - len(header) - 1
+        if padding < 0:
+            raise ValueError('%s: no room in the header for %d records' % (self.path, count))
+        return npy_magic + struct.pack('<H', size - len(npy_magic) - 2) \
+               + (header + ' '*padding + '\n').encode('latin1')
+
+    def append_records(self, records):
+        ''' Method appending a structured array of dtype self.dtype '''
+        records = np.asarray(records)
+        if records.dtype != self.dtype:
+            raise ValueError('records of dtype %s, expected %s' % (records.dtype, self.dtype))
+        self._fp.write(np.ascontiguousarray(records).tobytes())
+        self.count += len(records)
+        self._fp.seek(0)
+        self._fp.write(self._header(self.count))
+        self._fp.seek(0, os.SEEK_END)
+        self._fp.flush()
+
+    def append(self, output_properties, ids=None):
+        ''' Method appending a batch of predictions, see as_records '''
+        self.append_records(as_records(output_properties, ids, self.dtype[result_properties[0]]))
+
+    def write(self, rows):
+        ''' Method appending rows written by screen.py, the interface of
+        screen.ResultWriter; the line number is stored as id and the SMILES
+        are dropped '''
+        if not rows:
+            return
+        columns = list(zip(*rows))
+        self.append({key: columns[2 + j] for j, key in enumerate(result_properties)}, ids=columns[0])
+
+    def close(self):
+        ''' Method closing the file '''
+        self._fp.close()
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+Command line screener for files of SMILES.
+
+The input is read line by line and scored in fixed-size chunks, so memory use
+does not depend on the size of the input. Each line holds a SMILES string,
+optionally followed by measured HOMO and LUMO energies (see --columns). Lines
+which cannot be parsed or scored are written to an error file and the run
+continues.
+
+Usage (from the code directory):
+    python -m screen library.smi -o predictions.csv
+    cat library.smi | python -m screen --format jsonl > predictions.jsonl
+    python -m screen library.smi --format npy -o predictions.npy
+"""
+# -----------------------------------------------------------------------------
+import sys
+import csv
+import json
+import argparse
+import numpy as np
+import profiling
+from properties import Predictor
+from results import ResultArrayWriter, result_dtype
+# -----------------------------------------------------------------------------
+
+# Columns written for every scored molecule
+output_columns = ['line', 'smiles', 'homo', 'lumo', 'oxidation', 'reduction']
+
+# -----------------------------------------------------------------------------
+def parse_line(line, columns, delimiter=None):
+# -----------------------------------------------------------------------------
+    ''' Function for parsing one input line.
+
+    Inputs:
+            line - text of the line without the line terminator
+            columns - names of the columns of the line, the smiles column is
+                      required, homo and lumo columns are optional
+    Optional inputs:
+            delimiter - column delimiter, any whitespace by default
+    Output:
+            (smiles, homo, lumo) - homo and lumo are None when not given
+    '''
+# -----------------------------------------------------------------------------
+    fields = line.split(delimiter)
+    if len(fields) > len(columns):
+        raise ValueError('expected at most %d columns, found %d' % (len(columns), len(fields)))
+    record = dict(zip(columns, [field.strip() for field in fields]))
+    smiles = record.get('smiles', '')
+    if not smiles:
+        raise ValueError('missing SMILES')
+    energies = []
+    for key in ['homo', 'lumo']:
+        value = record.get(key, '')
+        energies.append(float(value) if value else None)
+    return smiles, energies[0], energies[1]
+
+# -----------------------------------------------------------------------------
+def score_chunk(predictor, records):
+# -----------------------------------------------------------------------------
+    ''' Function for scoring a chunk of parsed records with one vectorized
+    call. Missing HOMO/LUMO values are passed as NaN and predicted. The
+    functional groups of a SMILES repeated in the chunk are counted once.
+
+    Inputs:
+            predictor - Predictor used for scoring
+            records - list of (line number, smiles, homo, lumo)
+    Output:
+            rows - list of output rows, in input order
+            errors - list of (line number, smiles, message)
+    '''
+# -----------------------------------------------------------------------------
+    valid = []
+    vectors = []
+    errors = []
+    extracted = {}
+    for record in records:
+        vector = extracted.get(record[1])
+        if vector is None:
+            try:
+                vector = predictor.count_vector(record[1])
+            except Exception as error:
+                vector = '%s: %s' % (type(error).__name__, error)
+            extracted[record[1]] = vector
+        if isinstance(vector, str):
+            errors.append((record[0], record[1], vector))
+        else:
+            vectors.append(vector)
+            valid.append(record)
+
+    if not valid:
+        return [], errors
+    matrix = np.array(vectors, dtype=float).reshape(len(valid), -1)
+    homo = [record[2] for record in valid]
+    lumo = [record[3] for record in valid]
+    prediction = predictor.predict_counts(matrix,
+                                          homo=None if homo.count(None) == len(homo) else homo,
+                                          lumo=None if lumo.count(None) == len(lumo) else lumo)
+    columns = [prediction[key].tolist() for key in output_columns[2:]]
+    rows = [[record[0], record[1]] + [column[i] for column in columns] for i, record in enumerate(valid)]
+    return rows, errors
+
+# -----------------------------------------------------------------------------
+class ResultWriter:
+# -----------------------------------------------------------------------------
+    ''' A class writing scored rows as CSV or JSON lines.
+    This class has following attributes:
+        stream - text stream receiving the rows
+        format - either 'csv' or 'jsonl'
+    The CSV header is written on creation unless header is False.
+    '''
+    def __init__(self, stream, format='csv', header=True):
+        ''' Method to initialize the class '''
+        if format not in ('csv', 'jsonl'):
+            raise ValueError('unknown output format %r' % format)
+        self.stream = stream
+        self.format = format
+        self._csv = None
+        if format == 'csv':
+            self._csv = csv.writer(stream, lineterminator='\n')
+            if header:
+                self._csv.writerow(output_columns)
+
+    def write(self, rows):
+        ''' Method writing a list of rows '''
+        if self._csv is not None:
+            self._csv.writerows(rows)
+        else:
+            for row in rows:
+                self.stream.write(json.dumps(dict(zip(output_columns, row))) + '\n')
+        self.stream.flush()
+
+# -----------------------------------------------------------------------------
+def screen(lines, writer, predictor=None, chunk_size=10000, columns=('smiles',),
+           delimiter=None, errors=None, first_line=1):
+# -----------------------------------------------------------------------------
+    ''' Function for screening a stream of input lines. At most chunk_size
+    lines are held in memory at any time.
+
+    Inputs:
+            lines - iterable of raw input lines, as bytes or str
+            writer - ResultWriter or results.ResultArrayWriter receiving the
+                     predictions
+    Optional inputs:
+            predictor - Predictor used for scoring, a new one by default
+            chunk_size - number of lines scored together
+            columns - names of the columns of each line
+            delimiter - column delimiter, any whitespace by default
+            errors - text stream receiving the rejected lines
+            first_line - number of the first line, used in the reports
+    Output:
+            (scored, rejected) - number of scored and rejected lines
+    '''
+# -----------------------------------------------------------------------------
+    if predictor is None:
+        predictor = Predictor()
+    scored = 0
+    rejected = 0
+    chunk = []
+
+    def flush(chunk):
+        rows, failures = score_chunk(predictor, chunk)
+        writer.write(rows)
+        report(failures)
+        return len(rows), len(failures)
+
+    def report(failures):
+        if errors is not None:
+            for number, text, message in failures:
+                errors.write('%d\t%s\t%s\n' % (number, text, message))
+            errors.flush()
+
+    for number, line in enumerate(lines, first_line):
+        try:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            line = line.rstrip('\r\n')
+            if not line.strip():
+                continue
+            smiles, homo, lumo = parse_line(line, columns, delimiter)
+        except (ValueError, UnicodeDecodeError) as error:
+            text = line if isinstance(line, str) else line.decode('utf-8', 'replace').rstrip('\r\n')
+            report([(number, text, '%s: %s' % (type(error).__name__, error))])
+            rejected += 1
+            continue
+        chunk.append((number, smiles, homo, lumo))
+        if len(chunk) >= chunk_size:
+            counts = flush(chunk)
+            scored += counts[0]; rejected += counts[1]
+            chunk = []
+    if chunk:
+        counts = flush(chunk)
+        scored += counts[0]; rejected += counts[1]
+    return scored, rejected
+
+# -----------------------------------------------------------------------------
+def main(argv=None):
+# -----------------------------------------------------------------------------
+    ''' Command line entry point '''
+# -----------------------------------------------------------------------------
+    parser = argparse.ArgumentParser(description='Predict orbital energies and redox potentials for a file of SMILES.')
+    parser.add_argument('input', nargs='?', default='-',
+                        help='input file, one molecule per line, or a corpus directory (default: stdin)')
+    parser.add_argument('-o', '--output', default='-', help='output file (default: stdout)')
+    parser.add_argument('--format', choices=['csv', 'jsonl', 'npy'], default='csv',
+                        help='output format; npy writes line numbers and properties without SMILES')
+    parser.add_argument('--dtype', choices=['float64', 'float32'], default='float64',
+                        help='float type of the properties in npy output')
+    parser.add_argument('--chunk-size', type=int, default=10000, help='number of lines scored together')
+    parser.add_argument('--columns', default='smiles',
+                        help='comma separated names of the input columns, e.g. smiles,homo,lumo')
+    parser.add_argument('--delimiter', default=None, help='input column delimiter (default: whitespace)')
+    parser.add_argument('--errors', default=None, help='file receiving rejected lines (default: stderr)')
+    parser.add_argument('--coefficients', default=None, help='coefficients file (default: coefficients.jsn)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes; 0 uses every core (requires an input file)')
+    parser.add_argument('--checkpoint-dir', default=None,
+                        help='directory for finished shards, rerun with the same directory to resume')
+    parser.add_argument('--shard-size', type=int, default=64 << 20, help='approximate shard size in bytes')
+    parser.add_argument('--profile', default=None,
+                        help='write stage and functional group timings to this JSON file (single process only)')
+    args = parser.parse_args(argv)
+    if args.chunk_size < 1:
+        parser.error('--chunk-size must be positive')
+    columns = [name.strip() for name in args.columns.split(',')]
+    if 'smiles' not in columns:
+        parser.error('--columns must include smiles')
+    parallel = args.workers != 1 or args.checkpoint_dir is not None
+    if parallel and args.input == '-':
+        parser.error('--workers and --checkpoint-dir require an input file')
+    if args.shard_size < 1:
+        parser.error('--shard-size must be positive')
+    if args.workers < 0:
+        parser.error('--workers must not be negative')
+    if parallel and args.profile is not None:
+        parser.error('--profile cannot be combined with --workers or --checkpoint-dir')
+    if args.format == 'npy' and args.output == '-':
+        parser.error('--format npy requires an output file')
+    from corpus import Corpus, is_corpus, score_corpus
+    if is_corpus(args.input) and (columns != ['smiles'] or args.delimiter is not None):
+        parser.error('--columns and --delimiter apply to text input, '
+                     'a corpus keeps the homo and lumo columns it was built with')
+    profiler = None if args.profile is None else profiling.enable()
+
+    source = None
+    if args.format == 'npy':
+        output = ResultArrayWriter(args.output, result_dtype(args.dtype))
+    else:
+        output = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+    errors = sys.stderr if args.errors is None else open(args.errors, 'w')
+    try:
+        if parallel:
+            from parallel_screen import screen_parallel
+            scored, rejected = screen_parallel(args.input, output, workers=args.workers or None,
+                                               checkpoint=args.checkpoint_dir, shard_size=args.shard_size,
+                                               format=args.format, chunk_size=args.chunk_size,
+                                               columns=columns, delimiter=args.delimiter, errors=errors,
+                                               coefficients_file=args.coefficients, dtype=args.dtype)
+        elif is_corpus(args.input):
+            with Corpus(args.input) as corpus:
+                writer = output if args.format == 'npy' else ResultWriter(output, args.format)
+                scored, rejected = score_corpus(corpus, writer, Predictor(args.coefficients),
+                                                chunk_size=args.chunk_size, errors=errors)
+        else:
+            predictor = Predictor(args.coefficients)
+            source = sys.stdin.buffer if args.input == '-' else open(args.input, 'rb')
+            writer = output if args.format == 'npy' else ResultWriter(output, args.format)
+            scored, rejected = screen(source, writer, predictor, chunk_size=args.chunk_size,
+                                      columns=columns, delimiter=args.delimiter, errors=errors)
+    finally:
+        for stream in (source, output, errors):
+            if stream not in (None, sys.stdin.buffer, sys.stdout, sys.stderr):
+                stream.close()
+    sys.stderr.write('scored %d molecules, rejected %d lines\n' % (scored, rejected))
+    if profiler is not None:
+        profiling.disable()
+        profiler.to_json(args.profile)
+        sys.stderr.write(profiler.summary(limit=10))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
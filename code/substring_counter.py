@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+This module defines a class for counting a fixed set of substrings.
+"""
+# -----------------------------------------------------------------------------
+from functools import lru_cache
+# -----------------------------------------------------------------------------
+
+class SubstringCounter:
+     ''' A class for counting a fixed set of patterns in a string.
+         The patterns are de-duplicated once, when the counter is created, so
+         every distinct pattern is counted exactly once per string no matter
+         how many functional groups refer to it. The counts follow str.count
+         semantics: occurrences are non-overlapping and taken from left to right.
+         This class has following attribute:
+             patterns - Distinct patterns counted by the counter
+     '''
+     patterns = None
+
+     def __init__(self, patterns):
+         ''' Method to initialize the class '''
+         self.patterns = tuple(p for p in dict.fromkeys(patterns) if len(p) > 0)
+
+     def count(self, text):
+         ''' Method counting every pattern in text.
+         Input:
+             text   : String to be searched
+         Output:
+             counts : Dictionary with the number of each pattern in text
+         '''
+         return {pattern: text.count(pattern) for pattern in self.patterns}
+
+@lru_cache(maxsize=32)
+def substring_counter(patterns):
+     ''' Function returning the counter for a tuple of patterns. Counters are
+     cached, so a set of patterns is only compiled once. '''
+     return SubstringCounter(patterns)
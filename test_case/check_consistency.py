@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Consistency check of the prediction paths.
+
+The predictions of properties(), properties_batch() (with and without NaN
+HOMO/LUMO overrides) and Predictor.predict_counts() are compared with the
+original implementation: extract_features() on every functional group and
+the correlation evaluated term by term with predict(). Every path must agree
+within 1e-12 eV. Run from the test_case directory:
+    python check_consistency.py
+"""
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code'))
+
+import json
+import numpy as np
+from extract_features import create_functional_groups, extract_features
+from properties import (Predictor, properties, properties_batch, predict, load_coefficients,
+                        property_limits)
+# -----------------------------------------------------------------------------
+tolerance = 1e-12
+
+fjson = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'PAH_data.jsn')
+with open(fjson, 'r') as fid:
+    mol_properties = json.load(fid)
+
+# Heteroatom and halogen molecules in addition to the PAH series
+other_smiles = ['CCO', 'CC(=O)O', 'CC(=O)Cl', 'CSC(=O)N', 'C1=CC=NC=C1', 'ClC1=CC=CC=C1',
+                'BrC1=CC=C(F)C=C1', 'OC1=CC=CC=C1N(=O)=O', 'FC(F)(F)C1=CC=CC=C1', 'NC1=CC=C(C#N)C=C1',
+                'ICC(Br)CCl', 'O=C1C=CC(=O)C=C1']
+smiles = mol_properties['PAH']['SMILES'] + other_smiles
+homo = mol_properties['PAH']['Homo'] + [-6.5]*len(other_smiles)
+lumo = mol_properties['PAH']['Lumo'] + [-1.0]*len(other_smiles)
+keys = ['homo', 'lumo', 'oxidation', 'reduction']
+# -----------------------------------------------------------------------------
+
+functional_groups = create_functional_groups()
+coefficients = load_coefficients()
+
+def scale(value, key):
+    ''' Scaling of a property to the [-2, 2] input range of the correlation '''
+    lim = np.array(property_limits[key])
+    return -2.0 + ((4.0)/(lim[1] - lim[0])) * (value - lim[0])
+
+def unscale(prop, key):
+    ''' Scaling of a correlation output to the property range '''
+    lim = np.array(property_limits[key])
+    return prop*(lim[1] - lim[0]) + lim[0]
+
+def legacy_properties(mol, lumo=None, homo=None):
+    ''' The original prediction of a single molecule '''
+    features = extract_features(mol, functional_groups)
+    if lumo is None:
+        lumo = unscale(predict(features, coefficients['lumo']), 'lumo')
+    features['lumo'] = scale(lumo, 'lumo')
+    if homo is None:
+        homo = unscale(predict(features, coefficients['homo']), 'bandgap') + lumo
+    features['homo'] = scale(homo, 'homo')
+    output = {'lumo': lumo, 'homo': homo}
+    for key in ['reduction', 'oxidation']:
+        output[key] = unscale(predict(features, coefficients[key]), key)
+    return output
+
+failures = []
+
+def check(name, reference, result):
+    ''' Comparison of a path with the reference, one list of dictionaries '''
+    error = max(abs(float(result[i][key]) - float(reference[i][key]))
+                for i in range(len(reference)) for key in keys)
+    print('%-60s max abs diff %.3e' % (name, error))
+    if not error <= tolerance:
+        failures.append(name)
+
+def rows(output):
+    ''' Splitting a dictionary of property arrays into one dictionary per molecule '''
+    return [{key: output[key][i] for key in keys} for i in range(len(output[keys[0]]))]
+
+# -----------------------------------------------------------------------------
+# Overrides: none, HOMO, LUMO, both, and a mix of measured and missing values
+missing_homo = [value if i % 2 else np.nan for i, value in enumerate(homo)]
+missing_lumo = [value if i % 3 else None for i, value in enumerate(lumo)]
+cases = [('no override', None, None), ('homo', homo, None), ('lumo', None, lumo),
+         ('homo and lumo', homo, lumo), ('partial homo and lumo', missing_homo, missing_lumo)]
+
+predictor = Predictor()
+count_matrix = predictor.count_matrix(smiles)
+for name, homo_case, lumo_case in cases:
+    value = lambda values, i: None if values is None or values[i] is None or np.isnan(values[i]) else values[i]
+    reference = [legacy_properties(mol, lumo=value(lumo_case, i), homo=value(homo_case, i))
+                 for i, mol in enumerate(smiles)]
+    check('properties, %s' % name,
+          reference, [properties(mol, lumo=value(lumo_case, i), homo=value(homo_case, i))
+                      for i, mol in enumerate(smiles)])
+    check('properties_batch, %s' % name,
+          reference, rows(properties_batch(smiles, lumo=lumo_case, homo=homo_case)))
+    check('Predictor.predict_counts, %s' % name,
+          reference, rows(predictor.predict_counts(count_matrix, homo=homo_case, lumo=lumo_case)))
+    check('Predictor.predict_counts single rows, %s' % name,
+          reference, [rows(predictor.predict_counts(count_matrix[i:i+1],
+                                                    homo=None if homo_case is None else homo_case[i:i+1],
+                                                    lumo=None if lumo_case is None else lumo_case[i:i+1]))[0]
+                      for i in range(len(smiles))])
+
+if failures:
+    print('FAILED: %s' % ', '.join(failures))
+    sys.exit(1)
+print('all prediction paths agree within %g eV' % tolerance)